@@ -16,11 +16,26 @@ Version: 3.0.0 (Premium UI Edition - Groq FREE)
 
 import streamlit as st
 from groq import Groq
+import httpx
 import os
+import sys
+import csv
+import argparse
 import json
 import sqlite3
 import re
 import io
+import hashlib
+import threading
+import time
+import random
+import zlib
+import copy
+import atexit
+import logging
+import queue
+import tempfile
+from email.utils import parsedate_to_datetime
 from datetime import datetime
 from dotenv import load_dotenv
 from docx import Document
@@ -32,12 +47,18 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 import pandas as pd
+import numpy as np
 import nltk
-from collections import Counter
+from collections import Counter, OrderedDict, deque, namedtuple
+from dataclasses import dataclass, field, fields
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # =============================================================================
 # PREMIUM CSS STYLES
 # =============================================================================
@@ -493,10 +514,150 @@ div[data-testid="metric-container"] {
 # DATABASE SETUP
 # =============================================================================
 
-def init_database():
-    """Initialize SQLite database with required tables"""
-    conn = sqlite3.connect('sales_content.db')
-    cursor = conn.cursor()
+DB_PATH = 'sales_content.db'
+RESPONSE_CACHE_DB_PATH = 'response_cache.db'
+
+
+class ConnectionPool:
+    """Bounded pool of tuned SQLite connections to one database file.
+    
+    Connections are opened lazily, in WAL mode (readers never block the
+    writer) with a busy timeout instead of immediate "database is locked"
+    errors and synchronous=NORMAL, and are reused across threads. Reuse also
+    keeps sqlite3's per-connection statement cache warm, so the fixed SQL
+    strings below are prepared once per connection rather than per call.
+    At most max_size connections exist; further callers wait for one.
+    """
+    
+    def __init__(self, db_path=DB_PATH, max_size=8, busy_timeout_ms=5000, synchronous='NORMAL',
+                 cached_statements=256):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self.opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        with self._lock:
+            self.opened += 1
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; an uncommitted transaction is rolled back on return"""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+    
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and yield a cursor, committing on success"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            yield cursor
+            conn.commit()
+    
+    def close(self):
+        """Close the idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    def stats(self):
+        """Return connections opened so far and currently idle"""
+        with self._lock:
+            opened = self.opened
+        return {'opened': opened, 'idle': self._idle.qsize()}
+
+@st.cache_resource
+def get_database_pool(db_path=DB_PATH):
+    """Process-wide connection pool per database file"""
+    return ConnectionPool(db_path)
+
+INSERT_HISTORY_SQL = '''
+    INSERT INTO content_history 
+    (user_id, business_name, business_type, product_service, target_audience, 
+     offer, tone, platform, headline, dict_id, result_blob, search_copy)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SELECT_HISTORY_SQL = '''
+    SELECT id, user_id, business_name, business_type, product_service, target_audience,
+           offer, tone, platform, headline, created_at, full_response, dict_id, result_blob
+    FROM content_history 
+    WHERE user_id = ? 
+    ORDER BY created_at DESC 
+    LIMIT ?
+'''
+
+def init_database(pool=None):
+    """Bring the database schema up to date; returns the migrations applied"""
+    with (pool or get_database_pool()).transaction() as cursor:
+        return apply_migrations(cursor)
+
+@st.cache_resource
+def ensure_database():
+    """Run init_database once per process instead of on every rerun.
+    
+    Rows still in the pre-compression format are rewritten in the background.
+    """
+    applied = init_database()
+    get_background_executor().submit(compact_history)
+    get_background_executor().submit(index_history_search)
+    return applied
+
+def apply_migrations(cursor):
+    """Apply MIGRATIONS newer than the recorded schema version, in order.
+    
+    The version check and the migrations share one IMMEDIATE transaction, so
+    concurrent processes cannot apply the same migration twice.
+    """
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    current = cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        migrate(cursor)
+        cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+        applied.append(name)
+    return applied
+
+def create_tables(cursor):
+    """Migration 1: the base tables (no-op on databases created before versioning)"""
     
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -533,21 +694,275 @@ def init_database():
         )
     ''')
     
-    conn.commit()
-    conn.close()
+    # LSH band keys of past headlines/captions (see NearDuplicateIndex)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS headline_minhash (
+            band_key INTEGER PRIMARY KEY
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS headline_minhash_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_history_id INTEGER NOT NULL
+        )
+    ''')
+    
+    # Precomputed few-shot exemplar per generation (see ExemplarIndex)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exemplar_index (
+            history_id INTEGER PRIMARY KEY,
+            business_type TEXT NOT NULL,
+            tone TEXT NOT NULL,
+            business_name TEXT NOT NULL,
+            line TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            score REAL NOT NULL
+        )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_exemplar_lookup ON exemplar_index (business_type, tone, score DESC, history_id DESC)'
+    )
+
+def add_history_user_index(cursor):
+    """Migration 2: serve get_user_history from an index instead of a scan and sort"""
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_history_user_created ON content_history (user_id, created_at DESC)'
+    )
+
+def add_compressed_storage(cursor):
+    """Migration 3: compressed result blobs, a narrow headline column and compaction state.
+    
+    Rows that exist now keep their legacy columns until compact_history
+    rewrites them in the background; every later row is written compressed.
+    """
+    cursor.execute('ALTER TABLE content_history ADD COLUMN headline TEXT')
+    cursor.execute('ALTER TABLE content_history ADD COLUMN dict_id INTEGER')
+    cursor.execute('ALTER TABLE content_history ADD COLUMN result_blob BLOB')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compression_dicts (
+            id INTEGER PRIMARY KEY,
+            zdict BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    samples = [
+        row[0] for row in cursor.execute(
+            'SELECT full_response FROM content_history WHERE full_response IS NOT NULL ORDER BY id DESC LIMIT 500'
+        )
+    ]
+    cursor.execute('INSERT INTO compression_dicts (id, zdict) VALUES (1, ?)', (train_zdict(samples),))
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_compaction (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(
+        'INSERT OR REPLACE INTO history_compaction (id, next_id, last_id) '
+        'SELECT 1, COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM content_history'
+    )
+
+def add_history_search(cursor):
+    """Migration 4: FTS5 index over business fields and generated copy, kept in sync by triggers.
+    
+    The index is contentless, so copy is not stored a second time; triggers
+    derive it with history_search_text. Existing rows are indexed in the
+    background by index_history_search, and until then the delete/update
+    triggers skip rows in the pending range, which are not in the index yet.
+    Superseded by migration 9.
+    """
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            business_name, product_service, target_audience, offer, copy,
+            content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_fts_backfill (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(
+        'INSERT OR REPLACE INTO history_fts_backfill (id, next_id, last_id) '
+        'SELECT 1, COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM content_history'
+    )
+    
+    indexed = "old.id NOT BETWEEN (SELECT next_id FROM history_fts_backfill) AND (SELECT last_id FROM history_fts_backfill)"
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON content_history BEGIN
+            INSERT INTO history_fts (rowid, business_name, product_service, target_audience, offer, copy)
+            VALUES (new.id, new.business_name, new.product_service, new.target_audience, new.offer,
+                    history_search_text(new.dict_id, new.result_blob, new.full_response));
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON content_history WHEN {indexed} BEGIN
+            INSERT INTO history_fts (history_fts, rowid, business_name, product_service, target_audience, offer, copy)
+            VALUES ('delete', old.id, old.business_name, old.product_service, old.target_audience, old.offer,
+                    history_search_text(old.dict_id, old.result_blob, old.full_response));
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS history_fts_update
+        AFTER UPDATE OF business_name, product_service, target_audience, offer, dict_id, result_blob, full_response
+        ON content_history WHEN {indexed} BEGIN
+            INSERT INTO history_fts (history_fts, rowid, business_name, product_service, target_audience, offer, copy)
+            VALUES ('delete', old.id, old.business_name, old.product_service, old.target_audience, old.offer,
+                    history_search_text(old.dict_id, old.result_blob, old.full_response));
+            INSERT INTO history_fts (rowid, business_name, product_service, target_audience, offer, copy)
+            VALUES (new.id, new.business_name, new.product_service, new.target_audience, new.offer,
+                    history_search_text(new.dict_id, new.result_blob, new.full_response));
+        END
+    ''')
+
+def add_minhash_item_ids(cursor):
+    """Migration 5: record which past item each LSH band key came from.
+    
+    The old table only held band keys, which cannot be attributed to items,
+    so it is rebuilt from history by NearDuplicateIndex.backfill.
+    """
+    cursor.execute('DROP TABLE IF EXISTS headline_minhash')
+    cursor.execute('''
+        CREATE TABLE headline_minhash (
+            band_key INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            PRIMARY KEY (band_key, item_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('DELETE FROM headline_minhash_state')
+
+def add_completion_usage(cursor):
+    """Migration 6: observed completion lengths per prompt type (see CompletionSizer).
+    
+    IF NOT EXISTS because CompletionSizer used to create the table itself.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS completion_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prompt_type TEXT NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            truncated INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_completion_usage_type ON completion_usage (prompt_type, id)')
+
+def add_history_headline_index(cursor):
+    """Migration 7: look up a user's history by its top headline without a scan"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_user_headline ON content_history (user_id, headline)')
+
+def add_exemplar_index_state(cursor):
+    """Migration 8: ExemplarIndex backfill cursor, independent of rows save_to_history adds.
+    
+    It starts at 0, so the first backfill re-reads history once (the index
+    writes are idempotent) and picks up rows an earlier cursor skipped.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exemplar_index_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_history_id INTEGER NOT NULL
+        )
+    ''')
 
-def save_to_history(user_id, inputs, outputs):
-    """Save generated content to database history"""
-    conn = sqlite3.connect('sales_content.db')
-    cursor = conn.cursor()
+def add_history_search_copy(cursor):
+    """Migration 9: store the searchable copy in content_history and index it as external content.
+    
+    The contentless index of migration 4 had triggers derive copy through a
+    Python function, so any connection without it registered could not
+    write history, and deletes only matched if the derivation never changed.
+    Now insert_history fills search_copy, the triggers only read columns and
+    index_history_search re-indexes existing rows in the background.
+    """
+    cursor.execute('ALTER TABLE content_history ADD COLUMN search_copy TEXT')
+    for trigger in ('history_fts_insert', 'history_fts_delete', 'history_fts_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    cursor.execute('DROP TABLE IF EXISTS history_fts')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE history_fts USING fts5(
+            business_name, product_service, target_audience, offer, search_copy,
+            content='content_history', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute(
+        'INSERT OR REPLACE INTO history_fts_backfill (id, next_id, last_id) '
+        'SELECT 1, COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM content_history'
+    )
     
+    columns = 'business_name, product_service, target_audience, offer, search_copy'
+    indexed = "old.id NOT BETWEEN (SELECT next_id FROM history_fts_backfill) AND (SELECT last_id FROM history_fts_backfill)"
+    cursor.execute(f'''
+        CREATE TRIGGER history_fts_insert AFTER INSERT ON content_history BEGIN
+            INSERT INTO history_fts (rowid, {columns})
+            VALUES (new.id, new.business_name, new.product_service, new.target_audience, new.offer, new.search_copy);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER history_fts_delete AFTER DELETE ON content_history WHEN {indexed} BEGIN
+            INSERT INTO history_fts (history_fts, rowid, {columns})
+            VALUES ('delete', old.id, old.business_name, old.product_service, old.target_audience, old.offer, old.search_copy);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER history_fts_update AFTER UPDATE OF {columns} ON content_history WHEN {indexed} BEGIN
+            INSERT INTO history_fts (history_fts, rowid, {columns})
+            VALUES ('delete', old.id, old.business_name, old.product_service, old.target_audience, old.offer, old.search_copy);
+            INSERT INTO history_fts (rowid, {columns})
+            VALUES (new.id, new.business_name, new.product_service, new.target_audience, new.offer, new.search_copy);
+        END
+    ''')
+
+def add_bulk_history(cursor):
+    """Migration 10: which bulk-run rows already have a history row (see save_bulk_row)"""
     cursor.execute('''
-        INSERT INTO content_history 
-        (user_id, business_name, business_type, product_service, target_audience, 
-         offer, tone, platform, headlines, descriptions, hashtags, keywords, 
-         cta, seo_title, meta_description, landing_page_content, full_response)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+        CREATE TABLE IF NOT EXISTS bulk_history (
+            run_key TEXT NOT NULL,
+            row_number INTEGER NOT NULL,
+            history_id INTEGER NOT NULL,
+            PRIMARY KEY (run_key, row_number)
+        ) WITHOUT ROWID
+    ''')
+
+# (version, name, function(cursor)); append new migrations, never reorder or edit applied ones.
+MIGRATIONS = [
+    (1, 'create base tables', create_tables),
+    (2, 'index content_history by user and date', add_history_user_index),
+    (3, 'compressed result storage', add_compressed_storage),
+    (4, 'full-text history search', add_history_search),
+    (5, 'per-item near-duplicate index', add_minhash_item_ids),
+    (6, 'completion usage samples', add_completion_usage),
+    (7, 'index content_history by user and headline', add_history_headline_index),
+    (8, 'exemplar backfill cursor', add_exemplar_index_state),
+    (9, 'stored search copy', add_history_search_copy),
+    (10, 'bulk run history rows', add_bulk_history),
+]
+
+def save_to_history(user_id, inputs, outputs, pool=None, result=None):
+    """Save generated content to database history.
+    
+    outputs are the flattened fragments from flatten_outputs_for_history;
+    pass the generation's result too so the full original is kept rather
+    than only the fragments.
+    """
+    pool = pool or get_database_pool()
+    with pool.transaction() as cursor:
+        insert_history(cursor, user_id, inputs, outputs, result, get_result_codec(pool.db_path))
+
+def insert_history(cursor, user_id, inputs, outputs, result=None, codec=None):
+    """Insert one history row and its index entries (inside the caller's transaction)"""
+    if result is not None:
+        payload = {'result': ContentResult.from_dict(result).to_dict(), 'keywords': json.loads(outputs.get('keywords') or '[]')}
+    else:
+        payload = {'outputs': outputs}
+    dict_id, blob = (codec or get_result_codec()).compress(cursor, payload)
+    
+    cursor.execute(INSERT_HISTORY_SQL, (
         user_id,
         inputs.get('business_name', ''),
         inputs.get('business_type', ''),
@@ -556,37 +971,519 @@ def save_to_history(user_id, inputs, outputs):
         inputs.get('offer', ''),
         inputs.get('tone', ''),
         inputs.get('platform', ''),
-        outputs.get('headlines', ''),
-        outputs.get('descriptions', ''),
-        outputs.get('hashtags', ''),
-        outputs.get('keywords', ''),
-        outputs.get('cta', ''),
-        outputs.get('seo_title', ''),
-        outputs.get('meta_description', ''),
-        outputs.get('landing_page_content', ''),
-        json.dumps(outputs)
+        top_headline(outputs),
+        dict_id,
+        blob,
+        history_search_text(outputs)
     ))
+    history_id = cursor.lastrowid
     
-    conn.commit()
-    conn.close()
+    index_history_texts(cursor, inputs.get('business_name', ''), history_dedupe_texts(outputs))
+    index_exemplar(cursor, history_id, inputs, outputs)
+    return history_id
 
-def get_user_history(user_id, limit=50):
-    """Retrieve user's content generation history"""
-    conn = sqlite3.connect('sales_content.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT * FROM content_history 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC 
-        LIMIT ?
-    ''', (user_id, limit))
+def flatten_outputs_for_history(results, keywords):
+    """Build the per-column JSON fragments stored alongside a generation"""
+    result = ContentResult.from_dict(results)
+    google_ads = result.section('google_ads', GoogleAdsContent)
+    seo = result.section('seo', SeoContent)
     
+    return {
+        'headlines': json.dumps(google_ads.headlines),
+        'descriptions': json.dumps(google_ads.descriptions),
+        'hashtags': json.dumps(
+            result.section('instagram', InstagramContent).hashtags
+            or result.section('instagram_ad', InstagramAdContent).hashtags
+        ),
+        'keywords': json.dumps(keywords),
+        'captions': json.dumps(
+            result.section('instagram', InstagramContent).captions
+            or result.section('instagram_ad', InstagramAdContent).captions
+        ),
+        'cta': json.dumps(google_ads.cta_suggestions),
+        'seo_title': json.dumps(seo.title_list),
+        'meta_description': json.dumps(seo.meta_descriptions),
+        'landing_page_content': json.dumps(result.section('landing_page', LandingPageContent).to_dict())
+    }
+
+def get_user_history(user_id, limit=50, pool=None):
+    """Retrieve user's content generation history.
+    
+    Each record's 'content' is the stored payload (see history_payload)
+    decoded from whichever storage format the row uses.
+    """
+    pool = pool or get_database_pool()
+    with pool.connection() as conn:
+        return history_records(get_result_codec(pool.db_path), conn, conn.execute(SELECT_HISTORY_SQL, (user_id, limit)))
+
+def history_records(codec, conn, cursor):
+    """Records of an executed content_history query with their payload decoded into 'content'"""
     columns = [description[0] for description in cursor.description]
-    rows = cursor.fetchall()
-    conn.close()
+    records = []
+    for row in cursor.fetchall():
+        record = dict(zip(columns, row))
+        record['content'] = history_payload(
+            codec, conn, record.pop('dict_id'), record.pop('result_blob'), record.pop('full_response')
+        )
+        records.append(record)
+    return records
+
+# =============================================================================
+# COMPRESSED HISTORY STORAGE
+# =============================================================================
+
+ZDICT_SIZE = 32 * 1024
+
+# Frequent JSON keys and phrases: what a shared dictionary can pre-load.
+_ZDICT_FRAGMENT = re.compile(r'"[A-Za-z_]+":\[?"?|[A-Za-z][A-Za-z\',.!&% -]{5,48}')
+
+def train_zdict(samples, size=ZDICT_SIZE):
+    """Build a zlib preset dictionary from sample payloads and the prompt schemas.
+    
+    Fragments are scored by how many samples contain them times their
+    length; the best are placed last, where zlib finds them at the shortest
+    distances. The compact templates seed the keys before any history exists.
+    """
+    documents = [compiled.compact for compiled in COMPILED_PROMPTS.values()] + list(samples)
+    counts = Counter()
+    for document in documents:
+        counts.update(set(_ZDICT_FRAGMENT.findall(document)))
+    
+    chosen = []
+    used = 0
+    for fragment in sorted(counts, key=lambda fragment: counts[fragment] * len(fragment), reverse=True):
+        encoded = fragment.encode('utf-8')
+        if used + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        used += len(encoded)
+    return b''.join(reversed(chosen))
+
+
+class ResultCodec:
+    """zlib compression of history payloads with dictionaries stored in the database.
+    
+    Each blob records the id of the compression_dicts row it was written
+    with (0 means no dictionary), so a newer dictionary never invalidates
+    older rows. Dictionaries are loaded once and cached.
+    """
+    
+    def __init__(self, db_path=DB_PATH, level=9, pool=None):
+        self.db_path = db_path
+        self.level = level
+        self.pool = pool
+        self._dicts = None
+        self._lock = threading.Lock()
+    
+    def _load(self, conn=None):
+        if conn is None:
+            with (self.pool or get_database_pool(self.db_path)).connection() as conn:
+                return self._load(conn)
+        try:
+            rows = conn.execute('SELECT id, zdict FROM compression_dicts').fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        with self._lock:
+            self._dicts = {dict_id: bytes(zdict) for dict_id, zdict in rows}
+    
+    def _dict(self, conn, dict_id):
+        if self._dicts is None or (dict_id is not None and dict_id not in self._dicts):
+            self._load(conn)
+        return self._dicts.get(dict_id) if dict_id is not None else None
+    
+    def compress(self, cursor, payload):
+        """Return (dict_id, blob) for a JSON-serializable payload using the newest dictionary"""
+        conn = cursor.connection
+        if self._dicts is None:
+            self._load(conn)
+        dict_id = max(self._dicts, default=0)
+        data = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        if dict_id:
+            compressor = zlib.compressobj(self.level, zdict=self._dicts[dict_id])
+        else:
+            compressor = zlib.compressobj(self.level)
+        return dict_id, compressor.compress(data) + compressor.flush()
+    
+    def decompress(self, conn, dict_id, blob):
+        """Decode a blob written by compress (conn=None loads dictionaries on a pooled connection)"""
+        if dict_id:
+            zdict = self._dict(conn, dict_id)
+            if zdict is None:
+                raise ValueError(f"unknown compression dictionary {dict_id}")
+            decompressor = zlib.decompressobj(zdict=zdict)
+        else:
+            decompressor = zlib.decompressobj()
+        return json.loads(decompressor.decompress(bytes(blob)) + decompressor.flush())
+
+@st.cache_resource
+def get_result_codec(db_path=DB_PATH):
+    """Process-wide codec per database file"""
+    return ResultCodec(db_path)
+
+def history_payload(codec, conn, dict_id, blob, full_response):
+    """Stored payload of a history row in either storage format.
+    
+    Payloads are {'result': ..., 'keywords': [...]} for rows saved with their
+    result and {'outputs': {...}} (the flattened fragments) otherwise. An
+    unparseable legacy full_response is returned as the raw string.
+    """
+    if blob is not None:
+        return codec.decompress(conn, dict_id, blob)
+    if not full_response:
+        return None
+    try:
+        return {'outputs': json.loads(full_response)}
+    except json.JSONDecodeError:
+        return full_response
+
+def history_outputs(payload):
+    """Flattened output fragments of a payload from history_payload"""
+    if not isinstance(payload, dict):
+        return {}
+    if 'result' in payload:
+        return flatten_outputs_for_history(payload['result'], payload.get('keywords') or [])
+    outputs = payload.get('outputs')
+    return outputs if isinstance(outputs, dict) else {}
+
+def top_headline(outputs):
+    """First (best-ranked) headline of the flattened outputs, or None"""
+    try:
+        values = json.loads(outputs.get('headlines') or '[]')
+    except (TypeError, json.JSONDecodeError):
+        return None
+    if not isinstance(values, list):
+        return None
+    return next((value for value in values if isinstance(value, str) and value), None)
+
+def compact_history(pool=None, batch_size=200):
+    """Rewrite rows saved before migration 3 into the compressed format; returns rows rewritten.
+    
+    Works through history_compaction in short batches, each its own
+    transaction, so the app keeps reading and writing meanwhile and an
+    interrupted run resumes where it stopped. Freed pages are reused by new
+    rows; VACUUM returns them to the filesystem.
+    """
+    pool = pool or get_database_pool()
+    codec = get_result_codec(pool.db_path)
+    rewritten = 0
+    while True:
+        with pool.transaction() as cursor:
+            next_id, last_id = cursor.execute('SELECT next_id, last_id FROM history_compaction WHERE id = 1').fetchone()
+            if next_id > last_id:
+                break
+            rows = cursor.execute(
+                'SELECT id, full_response FROM content_history '
+                'WHERE id >= ? AND id <= ? AND result_blob IS NULL ORDER BY id LIMIT ?',
+                (next_id, last_id, batch_size)
+            ).fetchall()
+            for history_id, full_response in rows:
+                outputs = history_outputs(history_payload(codec, cursor.connection, None, None, full_response))
+                dict_id, blob = codec.compress(cursor, {'outputs': outputs})
+                cursor.execute(
+                    'UPDATE content_history SET headline = ?, dict_id = ?, result_blob = ?, headlines = NULL, '
+                    'descriptions = NULL, hashtags = NULL, keywords = NULL, cta = NULL, seo_title = NULL, '
+                    'meta_description = NULL, landing_page_content = NULL, full_response = NULL WHERE id = ?',
+                    (top_headline(outputs), dict_id, blob, history_id)
+                )
+            next_id = rows[-1][0] + 1 if len(rows) == batch_size else last_id + 1
+            cursor.execute('UPDATE history_compaction SET next_id = ? WHERE id = 1', (next_id,))
+            rewritten += len(rows)
+    return rewritten
+
+def history_storage_stats(pool=None):
+    """Row counts and stored payload bytes per storage format"""
+    with (pool or get_database_pool()).connection() as conn:
+        compressed, compressed_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(result_blob)), 0) FROM content_history WHERE result_blob IS NOT NULL'
+        ).fetchone()
+        legacy, legacy_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(full_response)), 0) FROM content_history WHERE result_blob IS NULL'
+        ).fetchone()
+    return {
+        'compressed_rows': compressed,
+        'compressed_bytes': compressed_bytes,
+        'legacy_rows': legacy,
+        'legacy_bytes': legacy_bytes
+    }
+
+# =============================================================================
+# HISTORY WRITE-BEHIND
+# =============================================================================
+
+class HistoryWriter:
+    """Background writer that batches save_to_history calls.
+    
+    submit() only enqueues; a daemon thread drains the bounded queue and
+    commits up to batch_size rows per transaction, as soon as a batch is full
+    or flush_interval seconds after its first row. When the queue is full a
+    submit waits up to put_timeout seconds (backpressure) and then writes
+    the row itself, so nothing is dropped. A batch that fails to commit is
+    retried row by row through save_to_history; rows that still fail are
+    counted in stats() with the last error. close() drains the queue and
+    runs at interpreter exit.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, pool=None, max_queue=1000, batch_size=50, flush_interval=1.0, put_timeout=5.0):
+        self.pool = pool or get_database_pool()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        # Held while checking _closed and enqueueing, so no row lands behind
+        # the stop sentinel. The writer thread never takes it.
+        self._close_lock = threading.Lock()
+        self._stats = Counter()
+        self._peak_depth = 0
+        self._last_error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+    
+    def submit(self, user_id, inputs, outputs, result=None):
+        """Queue one history row; blocks only when the queue is full"""
+        row = (user_id, dict(inputs), dict(outputs), result)
+        with self._close_lock:
+            queued = not self._closed and self._enqueue(row)
+        if not queued:
+            self._write_inline(row)
+            return
+        self._count('enqueued')
+        with self._lock:
+            self._peak_depth = max(self._peak_depth, self._queue.qsize())
+    
+    def _enqueue(self, row):
+        """Put row on the queue, waiting up to put_timeout; False if it stayed full"""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('blocked')
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+            except queue.Full:
+                self._count('written_inline')
+                return False
+        return True
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                self._queue.task_done()
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+            if stop:
+                return
+    
+    def _write(self, rows):
+        """Insert rows in one transaction, retrying each row inline if it fails"""
+        codec = get_result_codec(self.pool.db_path)
+        try:
+            with self.pool.transaction() as cursor:
+                for user_id, inputs, outputs, result in rows:
+                    insert_history(cursor, user_id, inputs, outputs, result, codec)
+        except Exception:
+            self._count('batch_failures')
+            for row in rows:
+                self._write_inline(row)
+            return
+        self._count('written', len(rows))
+        self._count('batches')
+    
+    def _write_inline(self, row):
+        """Save one row in its own transaction, recording the error if it fails"""
+        user_id, inputs, outputs, result = row
+        try:
+            save_to_history(user_id, inputs, outputs, self.pool, result)
+        except Exception as e:
+            with self._lock:
+                self._stats['failed'] += 1
+                self._last_error = f"{type(e).__name__}: {e}"
+            return
+        self._count('written')
+        self._count('batches')
+    
+    def flush(self):
+        """Block until every queued row is committed"""
+        self._queue.join()
+    
+    def close(self):
+        """Drain the queue and stop the writer thread (idempotent)"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(self._STOP)
+        self._thread.join()
+    
+    def stats(self):
+        """Queue depth and write counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            peak = self._peak_depth
+            last_error = self._last_error
+        written, batches = stats.get('written', 0), stats.get('batches', 0)
+        return {
+            'depth': self._queue.qsize(),
+            'peak_depth': peak,
+            'capacity': self._queue.maxsize,
+            'enqueued': stats.get('enqueued', 0),
+            'written': written,
+            'batches': batches,
+            'avg_batch': written / batches if batches else 0.0,
+            'blocked': stats.get('blocked', 0),
+            'written_inline': stats.get('written_inline', 0),
+            'batch_failures': stats.get('batch_failures', 0),
+            'failed': stats.get('failed', 0),
+            'last_error': last_error
+        }
+
+@st.cache_resource
+def get_history_writer():
+    """Process-wide write-behind queue for content history"""
+    return HistoryWriter()
+
+# =============================================================================
+# HISTORY SEARCH
+# =============================================================================
+
+# bm25 weights for business_name, product_service, target_audience, offer, search_copy
+# (CROSS JOIN below pins history_fts as the outer loop; otherwise the planner
+# may walk every row of the user's history and re-run the MATCH for each.)
+SEARCH_WEIGHTS = (8.0, 4.0, 2.0, 2.0, 1.0)
+SEARCH_MAX_TERMS = 12
+# Above this many matches, bm25-sorting them all costs more than it is worth:
+# such broad queries are listed newest first, which FTS5 serves without a sort.
+SEARCH_RANK_LIMIT = 20000
+
+SEARCH_HISTORY_SQL = '''
+    SELECT h.id, h.user_id, h.business_name, h.business_type, h.product_service, h.target_audience,
+           h.offer, h.tone, h.platform, h.headline, h.created_at, h.full_response, h.dict_id, h.result_blob
+    FROM history_fts CROSS JOIN content_history h ON h.id = history_fts.rowid
+    WHERE history_fts MATCH ? AND h.user_id = ?
+    ORDER BY {order}
+    LIMIT ? OFFSET ?
+'''
+
+SEARCH_ORDER_RANKED = f"bm25(history_fts, {', '.join(map(str, SEARCH_WEIGHTS))}), h.id DESC"
+SEARCH_ORDER_RECENT = "history_fts.rowid DESC"
+
+COUNT_SEARCH_SQL = '''
+    SELECT COUNT(*) FROM history_fts CROSS JOIN content_history h ON h.id = history_fts.rowid
+    WHERE history_fts MATCH ? AND h.user_id = ?
+'''
+
+def history_search_text(outputs):
+    """Headlines and captions of flattened outputs, one per line (the search_copy column).
     
-    return [dict(zip(columns, row)) for row in rows]
+    Never raises: unreadable fragments contribute no copy.
+    """
+    lines = []
+    for column in ('headlines', 'captions'):
+        try:
+            values = json.loads(outputs.get(column) or '[]')
+        except (TypeError, json.JSONDecodeError):
+            continue
+        if isinstance(values, list):
+            lines.extend(value for value in values if isinstance(value, str))
+    return '\n'.join(lines)
+
+def fts_query(text):
+    """Turn free text into a safe FTS5 query: every word required, the last as a prefix"""
+    terms = re.findall(r'\w+', text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    # Single characters are matched whole; a one-letter prefix matches nearly everything.
+    last = f'"{terms[-1]}"*' if len(terms[-1]) > 1 else f'"{terms[-1]}"'
+    return ' '.join([f'"{term}"' for term in terms[:-1]] + [last])
+
+def search_history(text, user_id, page=1, per_page=10, pool=None):
+    """Ranked, paginated full-text search over a user's history.
+    
+    Returns {'total', 'page', 'pages', 'ranked', 'records'}; records have
+    the same shape as get_user_history's. Best matches come first, newest
+    first on ties, unless more than SEARCH_RANK_LIMIT rows match (ranked is
+    then False and results are newest first).
+    """
+    query = fts_query(text)
+    if query is None:
+        return {'total': 0, 'page': 1, 'pages': 0, 'ranked': True, 'records': []}
+    pool = pool or get_database_pool()
+    with pool.connection() as conn:
+        total = conn.execute(COUNT_SEARCH_SQL, (query, user_id)).fetchone()[0]
+        pages = -(-total // per_page)
+        page = min(max(1, page), max(1, pages))
+        ranked = total <= SEARCH_RANK_LIMIT
+        sql = SEARCH_HISTORY_SQL.format(order=SEARCH_ORDER_RANKED if ranked else SEARCH_ORDER_RECENT)
+        records = history_records(
+            get_result_codec(pool.db_path), conn,
+            conn.execute(sql, (query, user_id, per_page, (page - 1) * per_page))
+        )
+    return {'total': total, 'page': page, 'pages': pages, 'ranked': ranked, 'records': records}
+
+def index_history_search(pool=None, batch_size=500):
+    """Fill search_copy for rows saved before migration 9 and add them to history_fts; returns rows indexed.
+    
+    Works through history_fts_backfill in short transactions, like
+    compact_history, and resumes where an interrupted run stopped.
+    """
+    pool = pool or get_database_pool()
+    codec = get_result_codec(pool.db_path)
+    indexed = 0
+    while True:
+        with pool.transaction() as cursor:
+            next_id, last_id = cursor.execute('SELECT next_id, last_id FROM history_fts_backfill WHERE id = 1').fetchone()
+            if next_id > last_id:
+                break
+            upper = cursor.execute(
+                'SELECT MAX(id) FROM (SELECT id FROM content_history WHERE id BETWEEN ? AND ? ORDER BY id LIMIT ?)',
+                (next_id, last_id, batch_size)
+            ).fetchone()[0]
+            upper = last_id if upper is None else upper
+            rows = cursor.execute(
+                'SELECT id, full_response, dict_id, result_blob FROM content_history '
+                'WHERE id BETWEEN ? AND ? AND search_copy IS NULL',
+                (next_id, upper)
+            ).fetchall()
+            # Rows in the pending range are not indexed yet, so this update fires no trigger.
+            cursor.executemany('UPDATE content_history SET search_copy = ? WHERE id = ?', [
+                (history_search_text(history_outputs(history_payload(codec, cursor.connection, dict_id, blob, full_response))),
+                 history_id)
+                for history_id, full_response, dict_id, blob in rows
+            ])
+            cursor.execute(
+                'INSERT INTO history_fts (rowid, business_name, product_service, target_audience, offer, search_copy) '
+                'SELECT id, business_name, product_service, target_audience, offer, search_copy '
+                'FROM content_history WHERE id BETWEEN ? AND ?',
+                (next_id, upper)
+            )
+            indexed += cursor.rowcount
+            cursor.execute('UPDATE history_fts_backfill SET next_id = ? WHERE id = 1', (upper + 1,))
+    return indexed
 
 # =============================================================================
 # NLP KEYWORD EXTRACTION ENGINE
@@ -666,35 +1563,12 @@ def generate_hashtags(keywords, platform='instagram'):
 class PromptTemplates:
     """Enhanced prompt templates for high-converting content"""
     
-    @staticmethod
-    def get_tone_modifier(tone):
-        """Return tone-specific writing instructions"""
-        tone_modifiers = {
-            'Professional': "Use formal, business-appropriate language. Be authoritative and trustworthy. Focus on value propositions and credibility.",
-            'Emotional': "Connect emotionally with the reader. Use storytelling elements. Appeal to feelings, desires, and aspirations. Use power words that trigger emotions.",
-            'Exciting': "Use energetic, dynamic language. Create enthusiasm and anticipation. Use action words and create FOMO (fear of missing out).",
-            'Urgent': "Create a sense of urgency and scarcity. Use time-sensitive language. Emphasize limited availability or time-bound offers. Use words like NOW, TODAY, LIMITED, HURRY.",
-            'Friendly': "Use warm, conversational tone. Be approachable and relatable. Write as if talking to a friend. Use casual language.",
-            'Luxury': "Use sophisticated, premium language. Emphasize exclusivity and quality. Appeal to aspirational desires. Use words like EXCLUSIVE, PREMIUM, ELITE."
-        }
-        return tone_modifiers.get(tone, tone_modifiers['Professional'])
-    
-    @staticmethod
-    def google_ads_prompt(inputs):
-        """Generate Google Ads content prompt with high-converting headlines"""
-        return f"""
+    # Template bodies, rendered before the per-request business block. They are
+    # compiled once at import (see COMPILED_PROMPTS) into a full and a
+    # compact variant.
+    GOOGLE_ADS = """
 You are a world-class Google Ads copywriter who has generated millions in revenue. Create IRRESISTIBLE, HIGH-CONVERTING Google Ads content.
 
-BUSINESS DETAILS:
-- Business Name: {inputs['business_name']}
-- Business Type: {inputs['business_type']}
-- Product/Service: {inputs['product_service']}
-- Target Audience: {inputs['target_audience']}
-- Offer: {inputs['offer']}
-- Tone: {inputs['tone']}
-
-TONE INSTRUCTIONS: {PromptTemplates.get_tone_modifier(inputs['tone'])}
-
 HEADLINE POWER FORMULAS (Use these patterns):
 1. [Number] + [Benefit] + [Timeframe] → "Get 3X Sales in 30 Days"
 2. [Action Verb] + [Desire] + [Differentiator] → "Unlock Premium Results Fast"
@@ -710,7 +1584,7 @@ STRICT CHARACTER LIMITS:
 - Descriptions: Maximum 90 characters each (including spaces)
 
 Generate the following in JSON format:
-{{
+{
     "headlines": [
         // 15 IRRESISTIBLE headlines using power formulas, each MUST be 30 characters or less
         // Mix different formulas for variety
@@ -731,7 +1605,7 @@ Generate the following in JSON format:
     "cta_suggestions": [
         // 5 action-oriented CTAs
     ]
-}}
+}
 
 IMPORTANT: 
 - Every headline must trigger curiosity or desire
@@ -740,23 +1614,10 @@ IMPORTANT:
 - Count characters carefully - headlines over 30 chars will be rejected
 - Return ONLY valid JSON
 """
-
-    @staticmethod
-    def facebook_instagram_prompt(inputs):
-        """Generate Facebook/Instagram ad content prompt"""
-        return f"""
+    
+    SOCIAL_MEDIA = """
 You are a viral social media marketing expert with 10M+ followers experience. Create SCROLL-STOPPING content.
 
-BUSINESS DETAILS:
-- Business Name: {inputs['business_name']}
-- Business Type: {inputs['business_type']}
-- Product/Service: {inputs['product_service']}
-- Target Audience: {inputs['target_audience']}
-- Offer: {inputs['offer']}
-- Tone: {inputs['tone']}
-
-TONE INSTRUCTIONS: {PromptTemplates.get_tone_modifier(inputs['tone'])}
-
 VIRAL HOOKS FORMULAS:
 1. "Stop scrolling if you..." 
 2. "POV: You just discovered..."
@@ -766,8 +1627,8 @@ VIRAL HOOKS FORMULAS:
 6. "Here's why [common belief] is wrong..."
 
 Generate the following in JSON format:
-{{
-    "facebook_ad": {{
+{
+    "facebook_ad": {
         "primary_text": [
             // 3 SCROLL-STOPPING primary texts with hooks (125-500 chars)
             // Start with a hook that stops the scroll
@@ -782,8 +1643,8 @@ Generate the following in JSON format:
         "cta_button": [
             "Shop Now", "Learn More", "Sign Up", "Get Offer", "Book Now"
         ]
-    }},
-    "instagram_ad": {{
+    },
+    "instagram_ad": {
         "captions": [
             // 3 engaging captions with emojis, hooks, and story elements
             // Use line breaks for readability
@@ -801,14 +1662,14 @@ Generate the following in JSON format:
         "reels_hooks": [
             // 5 viral reel opening hooks
         ]
-    }},
+    },
     "carousel_hooks": [
         // 5 carousel slide headline hooks that make people swipe
     ],
     "engagement_questions": [
         // 3 questions to boost comments and engagement
     ]
-}}
+}
 
 IMPORTANT:
 - First line MUST stop the scroll
@@ -816,23 +1677,10 @@ IMPORTANT:
 - Create FOMO and urgency
 - Return ONLY valid JSON
 """
-
-    @staticmethod
-    def seo_content_prompt(inputs):
-        """Generate SEO-optimized content prompt"""
-        return f"""
+    
+    SEO_CONTENT = """
 You are an SEO expert who has ranked 1000+ pages on Google's first page.
 
-BUSINESS DETAILS:
-- Business Name: {inputs['business_name']}
-- Business Type: {inputs['business_type']}
-- Product/Service: {inputs['product_service']}
-- Target Audience: {inputs['target_audience']}
-- Offer: {inputs['offer']}
-- Tone: {inputs['tone']}
-
-TONE INSTRUCTIONS: {PromptTemplates.get_tone_modifier(inputs['tone'])}
-
 SEO TITLE FORMULAS:
 1. [Primary Keyword] - [Benefit] | [Brand]
 2. [Number] Best [Keyword] for [Audience] in [Year]
@@ -840,7 +1688,7 @@ SEO TITLE FORMULAS:
 4. [Keyword]: The Ultimate Guide to [Benefit]
 
 Generate the following in JSON format:
-{{
+{
     "seo_titles": [
         // 5 click-worthy SEO titles (50-60 characters) using formulas above
     ],
@@ -868,31 +1716,18 @@ Generate the following in JSON format:
     "image_alt_texts": [
         // 5 descriptive image alt texts
     ],
-    "schema_suggestions": {{
+    "schema_suggestions": {
         "type": "suggested schema type",
         "key_properties": ["list of key schema properties"]
-    }}
-}}
+    }
+}
 
 Return ONLY valid JSON.
 """
-
-    @staticmethod
-    def landing_page_prompt(inputs):
-        """Generate landing page content prompt"""
-        return f"""
+    
+    LANDING_PAGE = """
 You are a conversion rate optimization expert with a track record of 40%+ conversion rates.
 
-BUSINESS DETAILS:
-- Business Name: {inputs['business_name']}
-- Business Type: {inputs['business_type']}
-- Product/Service: {inputs['product_service']}
-- Target Audience: {inputs['target_audience']}
-- Offer: {inputs['offer']}
-- Tone: {inputs['tone']}
-
-TONE INSTRUCTIONS: {PromptTemplates.get_tone_modifier(inputs['tone'])}
-
 HEADLINE FORMULAS FOR HIGH CONVERSION:
 1. "[Result] Without [Pain Point]"
 2. "The [Adjective] Way to [Achieve Desire]"
@@ -900,29 +1735,29 @@ HEADLINE FORMULAS FOR HIGH CONVERSION:
 4. "Finally, [Solution] That [Unique Benefit]"
 
 Generate the following in JSON format:
-{{
-    "hero_section": {{
+{
+    "hero_section": {
         "headline": "Powerful headline using formula above (max 10 words)",
         "subheadline": "Supporting text that expands the promise (max 20 words)",
         "cta_button_text": "Action-oriented CTA (e.g., 'Start Free Trial')",
         "cta_supporting_text": "Risk reducer (e.g., 'No credit card required • Cancel anytime')"
-    }},
+    },
     "value_propositions": [
-        {{
+        {
             "title": "Benefit-focused title",
             "description": "2-3 sentence description with specific outcomes",
             "icon_suggestion": "relevant icon name"
-        }}
+        }
         // 4 total value propositions
     ],
     "features_benefits": [
-        {{
+        {
             "feature": "Feature name",
             "benefit": "What it means for the user (outcome-focused)"
-        }}
+        }
         // 6 feature-benefit pairs
     ],
-    "social_proof": {{
+    "social_proof": {
         "testimonial_prompts": [
             // 3 testimonial templates
         ],
@@ -932,46 +1767,33 @@ Generate the following in JSON format:
         "trust_badges": [
             // 5 trust elements
         ]
-    }},
+    },
     "faq_questions": [
-        {{
+        {
             "question": "Common objection as question",
             "answer": "Objection-handling answer"
-        }}
+        }
         // 5 FAQ items that handle objections
     ],
     "urgency_elements": [
         // 3 urgency/scarcity elements
     ],
-    "final_cta": {{
+    "final_cta": {
         "headline": "Final push headline",
         "cta_text": "Strong final CTA",
         "guarantee": "Risk reversal guarantee"
-    }}
-}}
+    }
+}
 
 Return ONLY valid JSON.
 """
-
-    @staticmethod
-    def multi_platform_prompt(inputs):
-        """Generate content for all platforms at once"""
-        return f"""
+    
+    MULTI_PLATFORM = """
 You are a multi-channel marketing genius who has scaled brands from 0 to millions.
 
-BUSINESS DETAILS:
-- Business Name: {inputs['business_name']}
-- Business Type: {inputs['business_type']}
-- Product/Service: {inputs['product_service']}
-- Target Audience: {inputs['target_audience']}
-- Offer: {inputs['offer']}
-- Tone: {inputs['tone']}
-
-TONE INSTRUCTIONS: {PromptTemplates.get_tone_modifier(inputs['tone'])}
-
 Generate IRRESISTIBLE, HIGH-CONVERTING content for ALL platforms in JSON format:
-{{
-    "google_ads": {{
+{
+    "google_ads": {
         "headlines": [
             // 15 POWER headlines using formulas: numbers, benefits, urgency
             // Max 30 chars each - COUNT CAREFULLY
@@ -980,96 +1802,2886 @@ Generate IRRESISTIBLE, HIGH-CONVERTING content for ALL platforms in JSON format:
             // 5 compelling descriptions, max 90 chars each
         ],
         "keywords": ["15 high-intent keywords"]
-    }},
-    "facebook": {{
+    },
+    "facebook": {
         "primary_texts": [
             // 3 scroll-stopping ad texts with hooks
         ],
         "headlines": ["5 curiosity-driven headlines, max 40 chars"],
         "cta_buttons": ["3 CTA suggestions"]
-    }},
-    "instagram": {{
+    },
+    "instagram": {
         "captions": [
             // 3 viral captions with emojis and hooks
         ],
         "hashtags": ["25 strategic hashtags"],
         "story_texts": ["3 story overlay texts"],
         "reels_hooks": ["5 viral reel hooks"]
-    }},
-    "seo": {{
+    },
+    "seo": {
         "titles": ["5 click-worthy SEO titles, 50-60 chars"],
         "meta_descriptions": ["5 compelling meta descriptions, 150-160 chars"],
-        "keywords": {{
+        "keywords": {
             "primary": ["5 primary keywords"],
             "secondary": ["10 secondary keywords"],
             "long_tail": ["10 long-tail phrases"]
-        }}
-    }},
-    "landing_page": {{
+        }
+    },
+    "landing_page": {
         "hero_headline": "Powerful main headline",
         "hero_subheadline": "Supporting text",
         "value_props": ["4 benefit-focused value propositions"],
         "cta_texts": ["3 action-oriented CTAs"],
         "urgency_elements": ["3 urgency/scarcity elements"]
-    }},
-    "email": {{
+    },
+    "email": {
         "subject_lines": [
             // 5 high-open-rate subject lines (use curiosity, numbers, urgency)
         ],
         "preview_texts": ["3 preview texts"],
         "cta_buttons": ["3 email CTAs"]
-    }},
-    "general": {{
+    },
+    "general": {
         "taglines": ["5 memorable brand taglines"],
         "elevator_pitch": "30-second compelling pitch",
         "unique_selling_points": ["3 clear USPs"]
-    }}
-}}
+    }
+}
 
 Return ONLY valid JSON, no markdown or extra text.
 """
-
-# =============================================================================
-# LLM CONTENT GENERATION ENGINE (GROQ - FREE)
-# =============================================================================
-
-class ContentGenerator:
-    """Main content generation engine using Groq (FREE & FAST)"""
     
-    def __init__(self, api_key):
-        self.client = Groq(api_key=api_key)
-        self.model = "llama-3.3-70b-versatile"
+    @staticmethod
+    def get_tone_modifier(tone):
+        """Return tone-specific writing instructions"""
+        tone_modifiers = {
+            'Professional': "Use formal, business-appropriate language. Be authoritative and trustworthy. Focus on value propositions and credibility.",
+            'Emotional': "Connect emotionally with the reader. Use storytelling elements. Appeal to feelings, desires, and aspirations. Use power words that trigger emotions.",
+            'Exciting': "Use energetic, dynamic language. Create enthusiasm and anticipation. Use action words and create FOMO (fear of missing out).",
+            'Urgent': "Create a sense of urgency and scarcity. Use time-sensitive language. Emphasize limited availability or time-bound offers. Use words like NOW, TODAY, LIMITED, HURRY.",
+            'Friendly': "Use warm, conversational tone. Be approachable and relatable. Write as if talking to a friend. Use casual language.",
+            'Luxury': "Use sophisticated, premium language. Emphasize exclusivity and quality. Appeal to aspirational desires. Use words like EXCLUSIVE, PREMIUM, ELITE."
+        }
+        return tone_modifiers.get(tone, tone_modifiers['Professional'])
+    
+    @staticmethod
+    def business_block(inputs):
+        """Business details, tone and few-shot exemplars for one request.
+        
+        It goes after the static template body, so every request for a
+        template starts with the same bytes and providers with prefix
+        caching can reuse that prefix across businesses.
+        """
+        return f"""BUSINESS DETAILS:
+- Business Name: {inputs['business_name']}
+- Business Type: {inputs['business_type']}
+- Product/Service: {inputs['product_service']}
+- Target Audience: {inputs['target_audience']}
+- Offer: {inputs['offer']}
+- Tone: {inputs['tone']}
+
+TONE INSTRUCTIONS: {PromptTemplates.get_tone_modifier(inputs['tone'])}
+
+{inputs.get('exemplars', '')}"""
+    
+    @staticmethod
+    def google_ads_prompt(inputs, compact=False):
+        """Generate Google Ads content prompt with high-converting headlines"""
+        return COMPILED_PROMPTS['google_ads'].render(inputs, compact)
+    
+    @staticmethod
+    def facebook_instagram_prompt(inputs, compact=False):
+        """Generate Facebook/Instagram ad content prompt"""
+        return COMPILED_PROMPTS['social'].render(inputs, compact)
+    
+    @staticmethod
+    def seo_content_prompt(inputs, compact=False):
+        """Generate SEO-optimized content prompt"""
+        return COMPILED_PROMPTS['seo'].render(inputs, compact)
+    
+    @staticmethod
+    def landing_page_prompt(inputs, compact=False):
+        """Generate landing page content prompt"""
+        return COMPILED_PROMPTS['landing_page'].render(inputs, compact)
+    
+    @staticmethod
+    def multi_platform_prompt(inputs, compact=False):
+        """Generate content for all platforms at once"""
+        return COMPILED_PROMPTS['multi_platform'].render(inputs, compact)
+
+# =============================================================================
+# PIPELINE METRICS
+# =============================================================================
+
+class MetricCounters:
+    """Thread-safe named counters for pipeline statistics"""
+    
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+    
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+    
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+@st.cache_resource
+def get_pipeline_counters():
+    """Process-wide pipeline counters shared by all sessions and reruns"""
+    return MetricCounters()
+
+# =============================================================================
+# API CLIENT REGISTRY
+# =============================================================================
+
+class _TimedHTTPClient(httpx.Client):
+    """httpx client that reports TCP connect + TLS handshake time per request"""
+    
+    def __init__(self, on_request, **kwargs):
+        super().__init__(**kwargs)
+        self._on_request = on_request
+    
+    def send(self, request, **kwargs):
+        started = {}
+        setup = [0.0]
+        
+        def trace(event_name, info):
+            if event_name in ('connection.connect_tcp.started', 'connection.start_tls.started'):
+                started[event_name] = time.perf_counter()
+            elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+                begin = started.pop(event_name.replace('.complete', '.started'), None)
+                if begin is not None:
+                    setup[0] += time.perf_counter() - begin
+        
+        request.extensions.setdefault('trace', trace)
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            self._on_request(setup[0])
+
+
+class ClientRegistry:
+    """Process-wide pool of API clients keyed by provider and API key.
+    
+    Clients keep their HTTP connection pool (and TLS sessions) alive between
+    Generate clicks, reruns and sessions. The registry holds at most
+    ``max_clients`` clients, drops any client idle for longer than
+    ``idle_timeout`` seconds, and measures how much connection setup the
+    reuse saves.
+    
+    Evicted clients are only dropped from the registry, never closed: a
+    request in flight or a generator built earlier may still hold one, and
+    its connections are released once the last reference goes away.
+    """
+    
+    def __init__(self, max_clients=32, idle_timeout=900, keepalive_expiry=120):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self.requests = 0
+        self.handshakes = 0
+        self.handshake_seconds = 0.0
+    
+    @staticmethod
+    def _key(provider, api_key, base_url):
+        return provider, base_url, hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+    
+    def get(self, api_key, provider='groq', base_url=None):
+        """Return a shared client for (provider, api_key), creating it if needed.
+        
+        provider is 'groq', 'openai' (any OpenAI-compatible endpoint, selected
+        with base_url) or 'anthropic'.
+        """
+        key = self._key(provider, api_key, base_url)
+        now = time.monotonic()
+        evicted = 0
+        
+        with self._lock:
+            for old_key, entry in list(self._clients.items()):
+                if old_key != key and now - entry['last_used'] > self.idle_timeout:
+                    del self._clients[old_key]
+                    evicted += 1
+            
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                entry['last_used'] = now
+                self.reused += 1
+                client = entry['client']
+            else:
+                client = self._create(provider, api_key, base_url)
+                self._clients[key] = {'client': client, 'last_used': now}
+                self.created += 1
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+                    evicted += 1
+            
+            self.evicted += evicted
+        
+        return client
+    
+    def _create(self, provider, api_key, base_url=None):
+        if provider == 'anthropic':
+            # Recent anthropic SDKs only accept their own http client type, so
+            # the client keeps its own pool (no handshake timing for it).
+            from anthropic import Anthropic
+            return Anthropic(api_key=api_key, timeout=60.0)
+        
+        http_client = _TimedHTTPClient(
+            self._record_request,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            follow_redirects=True
+        )
+        try:
+            if provider == 'groq':
+                # Retries are handled by RateLimitScheduler, not the SDK.
+                return Groq(api_key=api_key, http_client=http_client, max_retries=0)
+            if provider == 'openai':
+                from openai import OpenAI
+                return OpenAI(api_key=api_key, base_url=base_url or None, http_client=http_client)
+            raise ValueError(f"Unknown provider: {provider}")
+        except Exception:
+            http_client.close()
+            raise
+    
+    def _record_request(self, setup_seconds):
+        with self._lock:
+            self.requests += 1
+            if setup_seconds > 0:
+                self.handshakes += 1
+                self.handshake_seconds += setup_seconds
+    
+    def stats(self):
+        """Return pool size and connection-setup savings measured so far"""
+        with self._lock:
+            requests = self.requests
+            handshakes = self.handshakes
+            avg_handshake = self.handshake_seconds / handshakes if handshakes else 0.0
+            return {
+                'clients': len(self._clients),
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted,
+                'requests': requests,
+                'handshakes': handshakes,
+                'avg_handshake_ms': avg_handshake * 1000,
+                # Every request served on a kept-alive connection skips one
+                # TCP + TLS setup of the measured average cost.
+                'saved_per_request_ms': avg_handshake * 1000 * (requests - handshakes) / requests if requests else 0.0,
+                'saved_total_s': avg_handshake * (requests - handshakes)
+            }
+
+@st.cache_resource
+def get_client_registry():
+    """Process-wide client registry shared by all sessions and reruns"""
+    return ClientRegistry()
+
+# =============================================================================
+# RATE LIMIT SCHEDULER
+# =============================================================================
+
+def estimate_tokens(text):
+    """Rough token count for English prompts (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+class RateLimitQueueFull(RuntimeError):
+    """Raised when too many requests are already waiting for rate-limit capacity"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out reservations instead of blocking.
+    
+    ``reserve`` always succeeds and returns how long the caller must wait
+    before its reservation is covered, so concurrent callers are spaced out
+    in arrival order rather than racing each other.
+    """
+    
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+    
+    def reserve(self, amount):
+        """Take amount from the bucket and return the seconds to wait for it"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+            if self.level >= 0:
+                return 0.0
+            return -self.level / self.refill_per_second
+    
+    def wait_for(self, amount):
+        """Seconds until amount would be covered, without reserving it.
+        
+        amount may exceed the capacity: it is then the total of several
+        reservations, and the result is when the last of them is covered.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (amount - self.level) / self.refill_per_second)
+    
+    def refund(self, amount):
+        """Give back tokens that were reserved but not used"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimitScheduler:
+    """Smooths Groq traffic per API key to just under the provider limits.
+    
+    Each key gets a requests/minute and a tokens/minute bucket sized at
+    ``headroom`` of the configured limits. Callers wait for their
+    reservation in a bounded queue, and 429/5xx replies are retried after
+    the server's Retry-After or a jittered exponential backoff, whichever
+    is longer.
+    """
+    
+    def __init__(self, requests_per_minute=30, tokens_per_minute=12000, max_waiting=32,
+                 max_retries=4, base_delay=1.0, max_delay=30.0, headroom=0.9):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_waiting = max_waiting
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.headroom = headroom
+        self._buckets = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.rejected = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+    
+    def configure(self, requests_per_minute, tokens_per_minute):
+        """Change the limits; buckets are rebuilt on their next use"""
+        with self._lock:
+            if (requests_per_minute, tokens_per_minute) != (self.requests_per_minute, self.tokens_per_minute):
+                self.requests_per_minute = requests_per_minute
+                self.tokens_per_minute = tokens_per_minute
+                self._buckets.clear()
+    
+    def _buckets_for(self, key):
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            rpm = self.requests_per_minute * self.headroom
+            tpm = self.tokens_per_minute * self.headroom
+            buckets = (TokenBucket(rpm, rpm / 60.0), TokenBucket(tpm, tpm / 60.0))
+            self._buckets[key] = buckets
+        return buckets
+    
+    @staticmethod
+    def _retry_after(error):
+        """Seconds requested by the Retry-After header of an API error, if any"""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        value = response.headers.get('retry-after-ms')
+        if value:
+            try:
+                return float(value) / 1000.0
+            except ValueError:
+                pass
+        value = response.headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    
+    def _acquire(self, key, tokens):
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise RateLimitQueueFull(
+                    f"Rate limit queue is full ({self.max_waiting} requests waiting), please try again shortly"
+                )
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            request_bucket, token_bucket = self._buckets_for(key)
+            blocked = self._blocked_until.get(key, 0.0) - time.monotonic()
+        
+        delay = max(request_bucket.reserve(1), token_bucket.reserve(tokens), blocked, 0.0)
+        try:
+            if delay > 0:
+                time.sleep(delay)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self.wait_seconds += delay
+        
+        return token_bucket
+    
+    def predict_wait(self, api_key, requests, tokens):
+        """Seconds the last of `requests` calls reserving `tokens` in total would wait now"""
+        key = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        with self._lock:
+            request_bucket, token_bucket = self._buckets_for(key)
+            blocked = self._blocked_until.get(key, 0.0) - time.monotonic()
+        return max(request_bucket.wait_for(requests), token_bucket.wait_for(tokens), blocked, 0.0)
+    
+    def call(self, api_key, estimated_tokens, request):
+        """Run request() once capacity is available, retrying on 429 and 5xx"""
+        key = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        
+        for attempt in range(self.max_retries + 1):
+            token_bucket = self._acquire(key, estimated_tokens)
+            try:
+                response = request()
+            except Exception as e:
+                status = getattr(e, 'status_code', None)
+                if not isinstance(status, int) or not (status == 429 or status >= 500) or attempt >= self.max_retries:
+                    raise
+                backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                retry_after = self._retry_after(e)
+                delay = max(backoff, retry_after or 0.0)
+                with self._lock:
+                    self.retries += 1
+                    if retry_after:
+                        # Everyone sharing this key waits out the server's window.
+                        self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), time.monotonic() + retry_after)
+                time.sleep(delay)
+                continue
+            
+            usage = getattr(response, 'usage', None)
+            total_tokens = getattr(usage, 'total_tokens', None)
+            if isinstance(total_tokens, int) and total_tokens < estimated_tokens:
+                token_bucket.refund(estimated_tokens - total_tokens)
+            return response
+    
+    def stats(self):
+        """Return queue depth and retry counters"""
+        with self._lock:
+            return {
+                'waiting': self.waiting,
+                'peak_waiting': self.peak_waiting,
+                'rejected': self.rejected,
+                'retries': self.retries,
+                'wait_seconds': self.wait_seconds
+            }
+
+@st.cache_resource
+def get_rate_limit_scheduler():
+    """Process-wide scheduler shared by all sessions and reruns"""
+    return RateLimitScheduler()
+
+# =============================================================================
+# LLM PROVIDERS & LATENCY ROUTING
+# =============================================================================
+
+Completion = namedtuple('Completion', ['text', 'prompt_tokens', 'completion_tokens', 'finish_reason', 'provider'])
+
+
+class LLMProvider:
+    """Base adapter: one chat backend (client + model) behind a common interface"""
+    
+    kind = 'base'
+    
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+    
+    @property
+    def name(self):
+        return f"{self.kind}:{self.model}"
+    
+    def complete(self, system, prompt, max_tokens, temperature):
+        """Return a Completion for one system + user prompt"""
+        raise NotImplementedError
+    
+    def stream(self, system, prompt, max_tokens, temperature, usage=None):
+        """Yield the completion text in chunks as it is generated.
+        
+        When the stream ends, a usage dict passed in receives the backend's
+        reported 'completion_tokens' and 'finish_reason' where it has them.
+        """
+        completion = self.complete(system, prompt, max_tokens, temperature)
+        if usage is not None:
+            usage.update(completion_tokens=completion.completion_tokens, finish_reason=completion.finish_reason)
+        yield completion.text
+
+
+class GroqProvider(LLMProvider):
+    """Groq chat completions, optionally paced by a RateLimitScheduler"""
+    
+    kind = 'groq'
+    # Groq reports streamed usage under x_groq on the last chunk unasked.
+    stream_kwargs = {}
+    
+    def __init__(self, client, model, scheduler=None, api_key=''):
+        super().__init__(client, model)
+        self.scheduler = scheduler
+        self.api_key = api_key
+    
+    def _create(self, system, prompt, max_tokens, temperature, **kwargs):
+        def request():
+            return self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs
+            )
+        
+        if self.scheduler is None:
+            return request()
+        estimated = estimate_tokens(system) + estimate_tokens(prompt) + max_tokens
+        return self.scheduler.call(self.api_key, estimated, request)
+    
+    def complete(self, system, prompt, max_tokens, temperature):
+        response = self._create(system, prompt, max_tokens, temperature)
+        usage = getattr(response, 'usage', None)
+        choice = response.choices[0]
+        return Completion(
+            text=choice.message.content or '',
+            prompt_tokens=getattr(usage, 'prompt_tokens', None),
+            completion_tokens=getattr(usage, 'completion_tokens', None),
+            finish_reason=choice.finish_reason,
+            provider=self.name
+        )
+    
+    def stream(self, system, prompt, max_tokens, temperature, usage=None):
+        for chunk in self._create(system, prompt, max_tokens, temperature, stream=True, **self.stream_kwargs):
+            # Usage arrives on the last chunk (Groq also reports it under x_groq).
+            reported = getattr(chunk, 'usage', None) or getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+            if usage is not None and reported is not None:
+                usage['completion_tokens'] = getattr(reported, 'completion_tokens', None)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if usage is not None and choice.finish_reason:
+                usage['finish_reason'] = choice.finish_reason
+            delta = choice.delta.content
+            if delta:
+                yield delta
+
+
+class OpenAICompatibleProvider(GroqProvider):
+    """Any OpenAI-compatible chat endpoint (OpenAI, vLLM, Together, ...)"""
+    
+    kind = 'openai'
+    stream_kwargs = {'stream_options': {'include_usage': True}}
+
+
+class AnthropicProvider(LLMProvider):
+    """Anthropic Messages API"""
+    
+    kind = 'anthropic'
+    
+    def complete(self, system, prompt, max_tokens, temperature):
+        response = self.client.messages.create(
+            model=self.model,
+            system=system,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=min(temperature, 1.0)
+        )
+        text = ''.join(block.text for block in response.content if getattr(block, 'type', '') == 'text')
+        return Completion(
+            text=text,
+            prompt_tokens=response.usage.input_tokens,
+            completion_tokens=response.usage.output_tokens,
+            finish_reason='length' if response.stop_reason == 'max_tokens' else response.stop_reason,
+            provider=self.name
+        )
+    
+    def stream(self, system, prompt, max_tokens, temperature, usage=None):
+        with self.client.messages.stream(
+            model=self.model,
+            system=system,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=min(temperature, 1.0)
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+            if usage is not None:
+                message = stream.get_final_message()
+                usage['completion_tokens'] = message.usage.output_tokens
+                usage['finish_reason'] = 'length' if message.stop_reason == 'max_tokens' else message.stop_reason
+
+
+class MockProvider(LLMProvider):
+    """Local offline backend returning a canned JSON reply after a fixed delay"""
+    
+    kind = 'mock'
+    
+    def __init__(self, response=None, latency=0.0, model='mock'):
+        super().__init__(None, model)
+        self.response = response if response is not None else {
+            "headlines": ["Mock Headline"],
+            "descriptions": ["Mock description generated offline."],
+            "cta_suggestions": ["Learn More"]
+        }
+        self.latency = latency
+    
+    def complete(self, system, prompt, max_tokens, temperature):
+        if self.latency:
+            time.sleep(self.latency)
+        text = json.dumps(self.response)
+        return Completion(
+            text=text,
+            prompt_tokens=estimate_tokens(system) + estimate_tokens(prompt),
+            completion_tokens=estimate_tokens(text),
+            finish_reason='stop',
+            provider=self.name
+        )
+
+
+class LatencyTracker:
+    """Rolling per-backend latency and failure windows shared across requests.
+    
+    Only successful requests are latency samples; failures go into a
+    separate outcome window so they never distort the p95 or decode fit.
+    """
+    
+    def __init__(self, window=50):
+        self.window = window
+        self._samples = {}
+        self._decode = {}
+        self._outcomes = {}
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+    
+    def _outcome(self, name, failed):
+        outcomes = self._outcomes.get(name)
+        if outcomes is None:
+            outcomes = self._outcomes[name] = deque(maxlen=self.window)
+        outcomes.append(failed)
+    
+    def record(self, name, seconds, completion_tokens=None):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._outcome(name, False)
+            if completion_tokens:
+                decode = self._decode.get(name)
+                if decode is None:
+                    decode = self._decode[name] = deque(maxlen=self.window)
+                decode.append((completion_tokens, seconds))
+    
+    def record_failure(self, name):
+        with self._lock:
+            self._outcome(name, True)
+    
+    def failure_rate(self, name):
+        """Share of the recent requests to a backend that failed (0.0 with none yet)"""
+        with self._lock:
+            outcomes = self._outcomes.get(name)
+            if not outcomes:
+                return 0.0
+            return sum(outcomes) / len(outcomes)
+    
+    def decode_model(self, name, min_samples=5):
+        """Fit latency = overhead + tokens * seconds_per_token for a backend.
+        
+        Returns (overhead_s, seconds_per_token) from a least-squares fit over
+        the recent successful requests, or None until there are min_samples
+        of them with varying lengths.
+        """
+        with self._lock:
+            points = list(self._decode.get(name, ()))
+        if len(points) < min_samples:
+            return None
+        
+        mean_tokens = sum(tokens for tokens, _ in points) / len(points)
+        mean_seconds = sum(seconds for _, seconds in points) / len(points)
+        spread = sum((tokens - mean_tokens) ** 2 for tokens, _ in points)
+        if spread == 0:
+            return None
+        per_token = sum((tokens - mean_tokens) * (seconds - mean_seconds) for tokens, seconds in points) / spread
+        if per_token <= 0:
+            return None
+        return max(0.0, mean_seconds - per_token * mean_tokens), per_token
+    
+    def p95(self, name):
+        """Rolling p95 latency in seconds, or 0.0 for backends with no samples yet"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+    
+    def count_hedge(self, won=False):
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+    
+    def stats(self):
+        with self._lock:
+            names = list(self._outcomes)
+            counts = {name: len(self._samples.get(name, ())) for name in names}
+            failures = {name: sum(self._outcomes[name]) for name in names}
+            hedges, wins = self.hedges, self.hedge_wins
+        return {
+            'backends': {
+                name: {
+                    'samples': counts[name],
+                    'failures': failures[name],
+                    'failure_rate': self.failure_rate(name),
+                    'p95_s': self.p95(name)
+                }
+                for name in names
+            },
+            'hedges': hedges,
+            'hedge_wins': wins
+        }
+
+
+class LatencyRouter:
+    """Routes each completion to the backend with the lowest rolling p95.
+    
+    Failures fall through to the next backend. With ``hedge_after`` set, a
+    second backend is fired once the first has been running that many
+    seconds, and the first result that passes ``validate`` wins.
+    """
+    
+    # Ranking cost of a backend that always fails, scaled by its failure rate.
+    FAILURE_PENALTY_SECONDS = 60.0
+    
+    def __init__(self, providers, tracker, hedge_after=None, executor=None):
+        if not providers:
+            raise ValueError("LatencyRouter needs at least one provider")
+        self.providers = list(providers)
+        self.tracker = tracker
+        self.hedge_after = hedge_after
+        self.executor = executor
+    
+    def ranked(self):
+        """Providers ordered by rolling p95 plus their failure penalty (stable for ties)"""
+        def cost(provider):
+            return (self.tracker.p95(provider.name)
+                    + self.tracker.failure_rate(provider.name) * self.FAILURE_PENALTY_SECONDS)
+        return sorted(self.providers, key=cost)
+    
+    def _timed(self, provider, system, prompt, max_tokens, temperature, validate):
+        started = time.perf_counter()
+        try:
+            completion = provider.complete(system, prompt, max_tokens, temperature)
+            parsed = validate(completion) if validate is not None else None
+        except Exception:
+            self.tracker.record_failure(provider.name)
+            raise
+        self.tracker.record(provider.name, time.perf_counter() - started, completion.completion_tokens)
+        return completion, parsed
+    
+    def complete(self, system, prompt, max_tokens, temperature, validate=None):
+        """Return (completion, validate(completion)) from the best backend"""
+        order = self.ranked()
+        if self.hedge_after is None or len(order) < 2:
+            last_error = None
+            for provider in order:
+                try:
+                    return self._timed(provider, system, prompt, max_tokens, temperature, validate)
+                except Exception as e:
+                    last_error = e
+            raise last_error
+        
+        return self._hedged(order, system, prompt, max_tokens, temperature, validate)
+    
+    def _hedged(self, order, system, prompt, max_tokens, temperature, validate):
+        pending = {}
+        remaining = list(order)
+        
+        executor = self.executor if self.executor is not None else get_background_executor()
+        
+        def launch():
+            provider = remaining.pop(0)
+            future = executor.submit(self._timed, provider, system, prompt, max_tokens, temperature, validate)
+            pending[future] = provider
+        
+        launch()
+        last_error = None
+        fallback = None
+        hedged = False
+        while pending:
+            timeout = self.hedge_after if remaining and not hedged else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            if not done:
+                # The primary is slower than the hedge threshold: race a second backend.
+                hedged = True
+                self.tracker.count_hedge()
+                launch()
+                continue
+            
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if validate is not None and result[1] is None and (pending or remaining):
+                    # Unusable reply: keep it as a fallback and wait for the other backend.
+                    fallback = result
+                    continue
+                if hedged and provider is not order[0]:
+                    self.tracker.count_hedge(won=True)
+                return result
+            
+            if remaining and not pending:
+                launch()
+        
+        if fallback is not None:
+            return fallback
+        raise last_error
+    
+    def stream(self, system, prompt, max_tokens, temperature, usage=None):
+        """Stream from the best-ranked backend, recording its total latency.
+        
+        The decode model only gets the sample when the backend reported
+        usage; a character-count estimate would skew its fit.
+        """
+        provider = self.ranked()[0]
+        usage = {} if usage is None else usage
+        started = time.perf_counter()
+        try:
+            for text in provider.stream(system, prompt, max_tokens, temperature, usage):
+                yield text
+        except Exception:
+            self.tracker.record_failure(provider.name)
+            raise
+        self.tracker.record(provider.name, time.perf_counter() - started, usage.get('completion_tokens'))
+
+@st.cache_resource
+def get_background_executor():
+    """Process-wide worker pool for work that outlives a single rerun"""
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix='content-worker')
+
+@st.cache_resource
+def get_latency_tracker():
+    """Process-wide latency statistics shared by all sessions and reruns"""
+    return LatencyTracker()
+
+# =============================================================================
+# ADAPTIVE COMPLETION SIZING
+# =============================================================================
+
+class CompletionSizer:
+    """Sizes max_tokens per prompt type from observed completion lengths.
+    
+    Completion token counts are kept per prompt type (persisted in SQLite so
+    a restart does not forget them). Once ``min_samples`` are known, the cap
+    is the p99 of the recent window plus ``margin``, never above the
+    caller's ceiling or below ``floor``.
+    """
+    
+    def __init__(self, pool=None, window=200, min_samples=20, margin=0.15, floor=256):
+        self.pool = pool or get_database_pool()
+        self.window = window
+        self.min_samples = min_samples
+        self.margin = margin
+        self.floor = floor
+        self._samples = {}
+        self._lock = threading.Lock()
+        self.truncations = 0
+    
+    def _window_for(self, prompt_type):
+        samples = self._samples.get(prompt_type)
+        if samples is None:
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    'SELECT completion_tokens FROM completion_usage WHERE prompt_type = ? ORDER BY id DESC LIMIT ?',
+                    (prompt_type, self.window)
+                ).fetchall()
+            samples = self._samples[prompt_type] = deque((row[0] for row in reversed(rows)), maxlen=self.window)
+        return samples
+    
+    def _p99(self, samples):
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+    
+    def size(self, prompt_type, ceiling):
+        """Return the max_tokens to request for prompt_type, at most ceiling"""
+        with self._lock:
+            samples = self._window_for(prompt_type)
+            if len(samples) < self.min_samples:
+                return ceiling
+            cap = int(self._p99(samples) * (1 + self.margin))
+        return max(min(self.floor, ceiling), min(ceiling, cap))
+    
+    def record(self, prompt_type, completion_tokens, truncated=False):
+        """Store one observed completion length (a truncated one is a lower bound)"""
+        if not isinstance(completion_tokens, int) or completion_tokens <= 0:
+            return
+        with self._lock:
+            self._window_for(prompt_type).append(completion_tokens)
+            if truncated:
+                self.truncations += 1
+        with self.pool.transaction() as cursor:
+            cursor.execute(
+                'INSERT INTO completion_usage (prompt_type, completion_tokens, truncated) VALUES (?, ?, ?)',
+                (prompt_type, completion_tokens, int(truncated))
+            )
+    
+    def seed(self, completion_tokens, shares):
+        """Split one completion over related prompt types by shares ({prompt_type: weight}).
+        
+        Only prompt types still short of min_samples get a sample, so a
+        split estimate never outweighs their own observed completions.
+        """
+        total = sum(shares.values())
+        if not isinstance(completion_tokens, int) or completion_tokens <= 0 or total <= 0:
+            return
+        for prompt_type, weight in shares.items():
+            with self._lock:
+                short = len(self._window_for(prompt_type)) < self.min_samples
+            if short and weight > 0:
+                self.record(prompt_type, max(1, round(completion_tokens * weight / total)))
+    
+    def typical(self, prompt_type):
+        """Median observed completion tokens for prompt_type, or None without samples"""
+        with self._lock:
+            samples = sorted(self._window_for(prompt_type))
+        return samples[len(samples) // 2] if samples else None
+    
+    def stats(self):
+        """Return sample count, p50 and p99 per prompt type"""
+        with self._lock:
+            result = {}
+            for prompt_type, samples in self._samples.items():
+                if not samples:
+                    continue
+                ordered = sorted(samples)
+                result[prompt_type] = {
+                    'samples': len(ordered),
+                    'p50': ordered[len(ordered) // 2],
+                    'p99': self._p99(ordered)
+                }
+            return result
+
+@st.cache_resource
+def get_completion_sizer():
+    """Process-wide completion sizer shared by all sessions and reruns"""
+    return CompletionSizer()
+
+# =============================================================================
+# RESPONSE CACHE
+# =============================================================================
+
+class ResponseCache:
+    """Persistent content-addressed cache for parsed model responses.
+    
+    Entries are keyed by a SHA-256 of everything that determines the
+    completion (model, system prompt, user prompt, max_tokens, temperature),
+    expire after ``ttl_seconds`` and are evicted least-recently-used once the
+    stored payloads exceed ``max_bytes``.
+    """
+    
+    def __init__(self, pool=None, ttl_seconds=24 * 3600, max_bytes=50 * 1024 * 1024):
+        self.pool = pool or get_database_pool(RESPONSE_CACHE_DB_PATH)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        with self.pool.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    hit_count INTEGER DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_lru ON response_cache (last_accessed)')
+    
+    @staticmethod
+    def make_key(model, system_prompt, prompt, max_tokens, temperature):
+        """Return the content address for one completion request"""
+        payload = json.dumps([model, system_prompt, prompt, max_tokens, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """Return the cached response for key, or None on a miss"""
+        now = time.time()
+        with self.pool.transaction() as cursor:
+            row = cursor.execute(
+                'SELECT response, created_at FROM response_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                cursor.execute(
+                    'UPDATE response_cache SET last_accessed = ?, hit_count = hit_count + 1 WHERE key = ?',
+                    (now, key)
+                )
+            elif row:
+                cursor.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                row = None
+        
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+    
+    def set(self, key, value):
+        """Store a response and evict least-recently-used entries over budget"""
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self.pool.transaction() as cursor:
+            cursor.execute(
+                '''INSERT OR REPLACE INTO response_cache
+                   (key, response, size, hit_count, created_at, last_accessed)
+                   VALUES (?, ?, ?, 0, ?, ?)''',
+                (key, payload, len(payload), now, now)
+            )
+            cursor.execute('DELETE FROM response_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+            
+            total = cursor.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache').fetchone()[0]
+            if total > self.max_bytes:
+                evict = []
+                for old_key, size in cursor.execute(
+                    'SELECT key, size FROM response_cache ORDER BY last_accessed ASC'
+                ).fetchall():
+                    if total <= self.max_bytes or old_key == key:
+                        break
+                    evict.append((old_key,))
+                    total -= size
+                cursor.executemany('DELETE FROM response_cache WHERE key = ?', evict)
+    
+    def clear(self):
+        """Drop every cached response and reset the counters"""
+        with self.pool.transaction() as cursor:
+            cursor.execute('DELETE FROM response_cache')
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        """Return hit/miss counters and current cache size"""
+        with self.pool.connection() as conn:
+            entries, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache'
+            ).fetchone()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'size_bytes': size
+        }
+
+@st.cache_resource
+def get_response_cache():
+    """Process-wide response cache shared by all sessions and reruns"""
+    return ResponseCache()
+
+# =============================================================================
+# REQUEST COALESCING
+# =============================================================================
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key onto one execution.
+    
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait on the same future and receive a deep copy of its
+    result (or its exception). The key is released as soon as the call
+    finishes, so later callers go through the response cache as usual.
+    """
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+    
+    def do(self, key, fn):
+        """Run fn() once per in-flight key; return (result, shared)"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        
+        if not leader:
+            return copy.deepcopy(future.result()), True
+        
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+    
+    def stats(self):
+        """Return executed and deduplicated call counts"""
+        with self._lock:
+            leaders, shared, in_flight = self.leaders, self.shared, len(self._calls)
+        calls = leaders + shared
+        return {
+            'executed': leaders,
+            'deduplicated': shared,
+            'in_flight': in_flight,
+            'dedupe_rate': shared / calls if calls else 0.0
+        }
+
+@st.cache_resource
+def get_singleflight():
+    """Process-wide request coalescer shared by all sessions and reruns"""
+    return SingleFlight()
+
+# =============================================================================
+# JSON EXTRACTION & REPAIR
+# =============================================================================
+
+class UnrepairableJSON(json.JSONDecodeError):
+    """Raised when a reply cannot be parsed even after local repair"""
+    
+    def __init__(self, msg, doc, pos, fragment):
+        super().__init__(msg, doc, pos)
+        self.fragment = fragment
+
+
+def extract_json_object(text):
+    """Find the outermost JSON object in text in a single linear pass.
+    
+    Strings, escapes and ``//`` / ``/* */`` comments are respected, so braces
+    inside them do not count. Returns (fragment, complete): the balanced
+    object when it closes, otherwise everything from the first ``{`` to the
+    end of the text with complete=False. Returns ('', False) when there is
+    no object at all.
+    """
+    start = text.find('{')
+    if start < 0:
+        return '', False
+    
+    depth = 0
+    in_string = False
+    escape = False
+    i = start
+    length = len(text)
+    while i < length:
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '/' and i + 1 < length and text[i + 1] in '/*':
+            end = text.find('\n' if text[i + 1] == '/' else '*/', i + 2)
+            i = length if end < 0 else end
+            continue
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1], True
+        i += 1
+    
+    return text[start:], False
+
+
+def repair_json(fragment):
+    """Fix the common defects in model-written JSON in one pass.
+    
+    Removes comments and trailing commas, closes an unterminated final
+    string, drops a dangling key or separator and closes any arrays/objects
+    left open by a truncated reply. Returns (repaired, cuts, raw): raw is the
+    cleaned text before closing, and cuts lists (position, closers) at every
+    comma so parse_json_response can drop a partial last element.
+    """
+    out = []
+    stack = []
+    cuts = []
+    in_string = False
+    escape = False
+    i = 0
+    length = len(fragment)
+    while i < length:
+        char = fragment[i]
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            i += 1
+            continue
+        
+        if char == '/' and i + 1 < length and fragment[i + 1] in '/*':
+            end = fragment.find('\n' if fragment[i + 1] == '/' else '*/', i + 2)
+            i = length if end < 0 else end + (1 if fragment[i + 1] == '/' else 2)
+            continue
+        
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if stack:
+                stack.pop()
+        elif char == ',':
+            cuts.append((len(out), ''.join(reversed(stack))))
+        out.append(char)
+        i += 1
+    
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    
+    text = ''.join(out).rstrip()
+    while text and text[-1] in ',:':
+        if text[-1] == ':':
+            # A key with no value: drop the key as well.
+            key_start = text.rfind('"', 0, text.rfind('"', 0, len(text) - 1))
+            text = text[:key_start].rstrip() if key_start >= 0 else text[:-1]
+        else:
+            text = text[:-1].rstrip()
+    
+    return text + ''.join(reversed(stack)), cuts, ''.join(out)
+
+
+def _loads(text):
+    # strict=False accepts raw newlines/tabs inside strings, which models
+    # routinely emit in multi-line captions.
+    return json.loads(text, strict=False)
+
+
+def parse_json_response(content):
+    """Parse the JSON object in a model reply, repairing it locally if needed.
+    
+    Raises UnrepairableJSON (a json.JSONDecodeError) carrying the extracted
+    fragment when no repair succeeds.
+    """
+    fragment, complete = extract_json_object(content)
+    if not fragment:
+        raise UnrepairableJSON("No JSON object found in response", content, 0, content.strip())
+    
+    if complete:
+        try:
+            return _loads(fragment)
+        except json.JSONDecodeError:
+            pass
+    
+    repaired, cuts, raw = repair_json(fragment)
+    try:
+        return _loads(repaired)
+    except json.JSONDecodeError as e:
+        error = e
+    
+    # Drop a partial trailing element by cutting back to an earlier comma.
+    for position, closers in reversed(cuts[-3:]):
+        try:
+            return _loads(raw[:position].rstrip() + closers)
+        except json.JSONDecodeError:
+            continue
+    
+    raise UnrepairableJSON(f"Could not repair JSON: {error.msg}", error.doc, error.pos, fragment)
+
+
+REPAIR_SYSTEM_PROMPT = "You repair malformed JSON. Return only the corrected JSON object with the same keys and content. No markdown, no explanations."
+
+# =============================================================================
+# COMPILED PROMPT TEMPLATES
+# =============================================================================
+
+def compact_schema(schema):
+    """Turn a commented JSON skeleton into minified JSON with inline hints.
+    
+    ``//`` comments inside an array become one string element (joined with
+    "; "), so the counts and limits they state are kept while comment
+    syntax, indentation and newlines are dropped. Falls back to the
+    comment-stripped text if the result is not valid JSON.
+    """
+    out = []
+    hints = []
+    in_string = False
+    escape = False
+    i = 0
+    length = len(schema)
+    while i < length:
+        char = schema[i]
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            i += 1
+            continue
+        
+        if char == '/' and i + 1 < length and schema[i + 1] == '/':
+            end = schema.find('\n', i)
+            end = length if end < 0 else end
+            if hints:
+                hints[-1].append(schema[i + 2:end].strip())
+            i = end
+            continue
+        
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            hints.append([] if char == '[' else None)
+        elif char in '}]':
+            notes = hints.pop() if hints else None
+            if notes:
+                body = ''.join(out[len(out) - out[::-1].index('['):]).strip() if '[' in out else ''
+                while out and (out[-1].isspace() or out[-1] == ','):
+                    out.pop()
+                if body:
+                    out.append(', ')
+                out.append(json.dumps('; '.join(notes), ensure_ascii=False))
+        out.append(char)
+        i += 1
+    
+    text = ''.join(out)
+    try:
+        return json.dumps(json.loads(text), ensure_ascii=False, separators=(',', ':'))
+    except json.JSONDecodeError:
+        return re.sub(r'\s+', ' ', text)
+
+
+class CompiledPrompt:
+    """One prompt template, parsed once into ready-to-send full and compact text"""
+    
+    def __init__(self, name, template):
+        self.name = name
+        schema, _ = extract_json_object(template)
+        head, tail = template.split(schema, 1)
+        self.full = template.strip()
+        self.compact = (head + compact_schema(schema) + tail).strip()
+        self.full_tokens = estimate_tokens(self.full)
+        self.compact_tokens = estimate_tokens(self.compact)
+    
+    def render(self, inputs, compact=False):
+        """Static template body followed by the per-request business block"""
+        return (self.compact if compact else self.full) + '\n\n' + PromptTemplates.business_block(inputs)
+
+
+def split_schema_sections(template):
+    """Split a template with an object schema into one template per top-level key.
+    
+    Each returned template keeps the text around the schema, with "for all
+    platforms" narrowed to the section, and asks for an object holding only
+    that key, so the replies merge back into the shape the full template
+    produces.
+    """
+    schema, _ = extract_json_object(template)
+    head, tail = template.split(schema, 1)
+    
+    sections = {}
+    position = 0
+    for key in json.loads(compact_schema(schema)):
+        position = schema.index(json.dumps(key), position)
+        value, _ = extract_json_object(schema[position:])
+        position = schema.index(value, position) + len(value)
+        section_head = re.sub(r'\bfor all platforms\b', f'for the "{key}" section', head, flags=re.IGNORECASE)
+        sections[key] = (
+            f'{section_head}{{\n    {json.dumps(key)}: {value}\n}}\n\n'
+            f'Generate ONLY the "{key}" section shown above.{tail}'
+        )
+    return sections
+
+
+COMPILED_PROMPTS = {
+    'google_ads': CompiledPrompt('google_ads', PromptTemplates.GOOGLE_ADS),
+    'social': CompiledPrompt('social', PromptTemplates.SOCIAL_MEDIA),
+    'seo': CompiledPrompt('seo', PromptTemplates.SEO_CONTENT),
+    'landing_page': CompiledPrompt('landing_page', PromptTemplates.LANDING_PAGE),
+    'multi_platform': CompiledPrompt('multi_platform', PromptTemplates.MULTI_PLATFORM)
+}
+
+COMPILED_PROMPTS.update({
+    f'multi_platform.{section}': CompiledPrompt(f'multi_platform.{section}', template)
+    for section, template in split_schema_sections(PromptTemplates.MULTI_PLATFORM).items()
+})
+
+def prompt_token_estimates():
+    """Estimated prompt tokens per template (without the business block)"""
+    return {
+        name: {'full': compiled.full_tokens, 'compact': compiled.compact_tokens}
+        for name, compiled in COMPILED_PROMPTS.items()
+    }
+
+# =============================================================================
+# CONTENT VALIDATION
+# =============================================================================
+
+# Expected top-level keys (and their JSON types) for each prompt type, plus the
+# character limits the prompts state for list items, addressed as "key" or
+# "section.key" and given as (min_chars, max_chars).
+CONTENT_SCHEMAS = {
+    'google_ads': {
+        'sections': {'headlines': list, 'descriptions': list, 'display_urls': list, 'keywords': list,
+                     'negative_keywords': list, 'cta_suggestions': list},
+        'limits': {'headlines': (None, 30), 'descriptions': (None, 90)}
+    },
+    'social': {
+        'sections': {'facebook_ad': dict, 'instagram_ad': dict, 'carousel_hooks': list, 'engagement_questions': list},
+        'limits': {'facebook_ad.headlines': (None, 40), 'facebook_ad.descriptions': (None, 30),
+                   'instagram_ad.story_text': (None, 100)}
+    },
+    'seo': {
+        'sections': {'seo_titles': list, 'meta_descriptions': list, 'h1_headings': list, 'h2_subheadings': list,
+                     'primary_keywords': list, 'secondary_keywords': list, 'long_tail_keywords': list,
+                     'url_slugs': list, 'image_alt_texts': list, 'schema_suggestions': dict},
+        'limits': {'seo_titles': (50, 60), 'meta_descriptions': (150, 160)}
+    },
+    'landing_page': {
+        'sections': {'hero_section': dict, 'value_propositions': list, 'features_benefits': list,
+                     'social_proof': dict, 'faq_questions': list, 'urgency_elements': list, 'final_cta': dict},
+        'limits': {}
+    },
+    'multi_platform': {
+        'sections': {'google_ads': dict, 'facebook': dict, 'instagram': dict, 'seo': dict,
+                     'landing_page': dict, 'email': dict, 'general': dict},
+        'limits': {'google_ads.headlines': (None, 30), 'google_ads.descriptions': (None, 90),
+                   'facebook.headlines': (None, 40), 'seo.titles': (50, 60),
+                   'seo.meta_descriptions': (150, 160)}
+    }
+}
+
+# "All Platforms" can also be generated one section per request; each section
+# is validated with the limits of the monolithic schema that apply to it.
+CONTENT_SCHEMAS.update({
+    f'multi_platform.{section}': {
+        'sections': {section: kind},
+        'limits': {
+            path: limits for path, limits in CONTENT_SCHEMAS['multi_platform']['limits'].items()
+            if path.split('.')[0] == section
+        }
+    }
+    for section, kind in CONTENT_SCHEMAS['multi_platform']['sections'].items()
+})
+
+def find_length_violations(prompt_type, result):
+    """Return (path, index, text, (min_chars, max_chars)) for every item outside its limit"""
+    violations = []
+    if not isinstance(result, dict):
+        return violations
+    for path, (min_chars, max_chars) in CONTENT_SCHEMAS.get(prompt_type, {}).get('limits', {}).items():
+        value = result
+        for part in path.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        if not isinstance(value, list):
+            continue
+        for index, item in enumerate(value):
+            length = len(str(item))
+            if (min_chars is not None and length < min_chars) or (max_chars is not None and length > max_chars):
+                violations.append((path, index, str(item), (min_chars, max_chars)))
+    return violations
+
+def failing_sections(prompt_type, result, max_violation_ratio=0.2):
+    """Return the top-level sections of result that fail schema or length checks.
+    
+    A section fails when it is missing, has the wrong type or is empty, or
+    when more than max_violation_ratio of the items in one of its limited
+    lists break the stated character limits.
+    """
+    schema = CONTENT_SCHEMAS[prompt_type]
+    if not isinstance(result, dict):
+        return list(schema['sections'])
+    
+    failing = [
+        key for key, expected in schema['sections'].items()
+        if not isinstance(result.get(key), expected) or not result.get(key)
+    ]
+    
+    violations = Counter(path for path, _, _, _ in find_length_violations(prompt_type, result))
+    for path, count in violations.items():
+        section = path.split('.')[0]
+        value = result
+        for part in path.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        if section not in failing and count > max_violation_ratio * len(value):
+            failing.append(section)
+    
+    return failing
+
+REWRITE_SYSTEM_PROMPT = "You are a precise copy editor. Rewrite marketing copy to fit character limits while keeping its meaning, tone and language. Return only a JSON object. No markdown, no explanations."
+
+def build_rewrite_prompt(violations):
+    """One batched request asking for a rewrite of every violating item, keyed by position"""
+    items = {}
+    for number, (_, _, text, (min_chars, max_chars)) in enumerate(violations):
+        if min_chars is not None and max_chars is not None:
+            limit = f"{min_chars}-{max_chars} characters"
+        elif max_chars is not None:
+            limit = f"at most {max_chars} characters"
+        else:
+            limit = f"at least {min_chars} characters"
+        items[str(number)] = {'text': text, 'length': len(text), 'limit': limit}
+    
+    return (
+        "Rewrite each item so its length (including spaces) fits its limit. "
+        "Return a JSON object mapping every id to the rewritten text only.\n\n"
+        + json.dumps(items, ensure_ascii=False, indent=1)
+    )
+
+def apply_rewrites(result, violations, rewrites):
+    """Splice rewrites that now fit their limits into result; returns the changed sections"""
+    changed = []
+    if not isinstance(rewrites, dict):
+        return changed
+    for number, (path, index, _, (min_chars, max_chars)) in enumerate(violations):
+        text = rewrites.get(str(number))
+        if not isinstance(text, str):
+            continue
+        text = text.strip()
+        if (min_chars is not None and len(text) < min_chars) or (max_chars is not None and len(text) > max_chars):
+            continue
+        
+        value = result
+        for part in path.split('.'):
+            value = value[part]
+        value[index] = text
+        section = path.split('.')[0]
+        if section not in changed:
+            changed.append(section)
+    return changed
+
+# =============================================================================
+# CONTENT RESULT MODEL
+# =============================================================================
+
+@dataclass(slots=True)
+class ContentSection:
+    """Typed content for one top-level section of a generation result.
+    
+    Subclasses declare one field per reply key they know. Keys a reply adds
+    beyond that, or values of an unexpected type, are kept in ``extra`` so
+    nothing the model wrote is lost. The role tuples name the fields that
+    feed the headline / description / CTA / hashtag / keyword summary, in
+    priority order.
+    """
+    extra: dict = field(default_factory=dict)
+    
+    HEADLINES = ()
+    DESCRIPTIONS = ()
+    CTAS = ()
+    HASHTAGS = ()
+    KEYWORDS = ()
+    # Variant lists checked for near-duplicates (see suppress_near_duplicates)
+    DEDUPE = ()
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Parse and type-check one reply section"""
+        values = {}
+        extra = {}
+        kinds = {f.name: f.type for f in fields(cls) if f.name != 'extra'}
+        for key, value in data.items():
+            kind = kinds.get(key)
+            coerced = _coerce(kind, value) if kind is not None else None
+            if coerced is None:
+                extra[key] = value
+            else:
+                values[key] = coerced
+        return cls(extra=extra, **values)
+    
+    def items(self):
+        """(key, value) for every non-empty field, then the extra keys"""
+        for f in fields(self):
+            if f.name == 'extra':
+                continue
+            value = getattr(self, f.name)
+            if value:
+                yield f.name, value
+        yield from self.extra.items()
+    
+    def to_dict(self):
+        return dict(self.items())
+    
+    def _first(self, role):
+        for name in role:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, str) and item:
+                        return item
+            elif isinstance(value, str) and value:
+                return value
+        return ''
+    
+    def _all(self, role):
+        collected = []
+        for name in role:
+            value = getattr(self, name)
+            if isinstance(value, dict):
+                for group in value.values():
+                    if isinstance(group, list):
+                        collected.extend(str(item) for item in group)
+            elif isinstance(value, list):
+                collected.extend(str(item) for item in value)
+        return collected
+
+
+def _coerce(kind, value):
+    """Return value as kind (list[str], list[dict], dict or str), or None if it is not one"""
+    if kind == list[str]:
+        if isinstance(value, str):
+            return [value]
+        if isinstance(value, list):
+            return [item if isinstance(item, (str, dict)) else str(item) for item in value]
+        return None
+    if kind == list[dict]:
+        return value if isinstance(value, list) else None
+    if kind is dict:
+        return value if isinstance(value, dict) else None
+    if kind is str:
+        if isinstance(value, (str, int, float)):
+            return str(value)
+        return None
+    return value
+
+
+@dataclass(slots=True)
+class GoogleAdsContent(ContentSection):
+    headlines: list[str] = field(default_factory=list)
+    descriptions: list[str] = field(default_factory=list)
+    display_urls: list[str] = field(default_factory=list)
+    keywords: list[str] = field(default_factory=list)
+    negative_keywords: list[str] = field(default_factory=list)
+    cta_suggestions: list[str] = field(default_factory=list)
+    
+    HEADLINES = ('headlines',)
+    DESCRIPTIONS = ('descriptions',)
+    CTAS = ('cta_suggestions',)
+    KEYWORDS = ('keywords', 'negative_keywords')
+    DEDUPE = ('headlines',)
+
+
+@dataclass(slots=True)
+class FacebookAdContent(ContentSection):
+    primary_text: list[str] = field(default_factory=list)
+    headlines: list[str] = field(default_factory=list)
+    descriptions: list[str] = field(default_factory=list)
+    cta_button: list[str] = field(default_factory=list)
+    
+    HEADLINES = ('headlines',)
+    DESCRIPTIONS = ('primary_text', 'descriptions')
+    CTAS = ('cta_button',)
+    DEDUPE = ('headlines',)
+
+
+@dataclass(slots=True)
+class InstagramAdContent(ContentSection):
+    captions: list[str] = field(default_factory=list)
+    story_text: list[str] = field(default_factory=list)
+    hashtags: list[str] = field(default_factory=list)
+    bio_link_cta: list[str] = field(default_factory=list)
+    reels_hooks: list[str] = field(default_factory=list)
+    
+    CTAS = ('bio_link_cta',)
+    HASHTAGS = ('hashtags',)
+    DEDUPE = ('captions',)
+
+
+@dataclass(slots=True)
+class FacebookContent(ContentSection):
+    primary_texts: list[str] = field(default_factory=list)
+    headlines: list[str] = field(default_factory=list)
+    cta_buttons: list[str] = field(default_factory=list)
+    
+    HEADLINES = ('headlines',)
+    DESCRIPTIONS = ('primary_texts',)
+    CTAS = ('cta_buttons',)
+    DEDUPE = ('headlines',)
+
+
+@dataclass(slots=True)
+class InstagramContent(ContentSection):
+    captions: list[str] = field(default_factory=list)
+    hashtags: list[str] = field(default_factory=list)
+    story_texts: list[str] = field(default_factory=list)
+    reels_hooks: list[str] = field(default_factory=list)
+    
+    HASHTAGS = ('hashtags',)
+    DEDUPE = ('captions',)
+
+
+@dataclass(slots=True)
+class SeoContent(ContentSection):
+    titles: list[str] = field(default_factory=list)
+    seo_titles: list[str] = field(default_factory=list)
+    meta_descriptions: list[str] = field(default_factory=list)
+    h1_headings: list[str] = field(default_factory=list)
+    h2_subheadings: list[str] = field(default_factory=list)
+    keywords: dict = field(default_factory=dict)
+    primary_keywords: list[str] = field(default_factory=list)
+    secondary_keywords: list[str] = field(default_factory=list)
+    long_tail_keywords: list[str] = field(default_factory=list)
+    url_slugs: list[str] = field(default_factory=list)
+    image_alt_texts: list[str] = field(default_factory=list)
+    schema_suggestions: dict = field(default_factory=dict)
+    
+    DESCRIPTIONS = ('meta_descriptions',)
+    KEYWORDS = ('keywords', 'primary_keywords', 'secondary_keywords', 'long_tail_keywords')
+    
+    @property
+    def title_list(self):
+        """SEO titles from either reply shape"""
+        return self.titles or self.seo_titles
+
+
+@dataclass(slots=True)
+class LandingPageContent(ContentSection):
+    hero_headline: str = ''
+    hero_subheadline: str = ''
+    hero_section: dict = field(default_factory=dict)
+    value_props: list[str] = field(default_factory=list)
+    value_propositions: list[dict] = field(default_factory=list)
+    features_benefits: list[dict] = field(default_factory=list)
+    social_proof: dict = field(default_factory=dict)
+    faq_questions: list[dict] = field(default_factory=list)
+    cta_texts: list[str] = field(default_factory=list)
+    urgency_elements: list[str] = field(default_factory=list)
+    final_cta: dict = field(default_factory=dict)
+    
+    HEADLINES = ('hero_headline',)
+    CTAS = ('cta_texts',)
+
+
+@dataclass(slots=True)
+class EmailContent(ContentSection):
+    subject_lines: list[str] = field(default_factory=list)
+    preview_texts: list[str] = field(default_factory=list)
+    cta_buttons: list[str] = field(default_factory=list)
+    
+    CTAS = ('cta_buttons',)
+
+
+@dataclass(slots=True)
+class GeneralContent(ContentSection):
+    taglines: list[str] = field(default_factory=list)
+    elevator_pitch: str = ''
+    unique_selling_points: list[str] = field(default_factory=list)
+
+
+# Top-level reply key -> section type, covering both the per-platform prompts
+# and the "All Platforms" prompt.
+SECTION_TYPES = {
+    'google_ads': GoogleAdsContent,
+    'facebook_ad': FacebookAdContent,
+    'instagram_ad': InstagramAdContent,
+    'facebook': FacebookContent,
+    'instagram': InstagramContent,
+    'seo': SeoContent,
+    'landing_page': LandingPageContent,
+    'email': EmailContent,
+    'general': GeneralContent
+}
+
+
+@dataclass(slots=True)
+class ContentResult:
+    """A parsed generation result: typed sections plus any loose top-level values"""
+    sections: dict = field(default_factory=dict)
+    
+    @classmethod
+    def from_dict(cls, results):
+        """Parse a merged reply dict once; failed (None) sections are dropped"""
+        if isinstance(results, ContentResult):
+            return results
+        sections = {}
+        for key, value in (results or {}).items():
+            if value is None:
+                continue
+            section_type = SECTION_TYPES.get(key)
+            if section_type is not None and isinstance(value, dict):
+                sections[key] = section_type.from_dict(value)
+            else:
+                sections[key] = value
+        return cls(sections)
+    
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+    
+    def __bool__(self):
+        return bool(self.sections)
+    
+    def section(self, key, section_type):
+        """The typed section under key, or an empty one of section_type"""
+        value = self.sections.get(key)
+        return value if isinstance(value, section_type) else section_type()
+    
+    def items(self):
+        """(key, section) pairs in reply order; loose values are returned as-is"""
+        return self.sections.items()
+    
+    def to_dict(self):
+        return {
+            key: value.to_dict() if isinstance(value, ContentSection) else value
+            for key, value in self.sections.items()
+        }
+    
+    def to_json(self):
+        """Compact serialization: empty fields dropped, no whitespace"""
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
+    
+    def summary(self):
+        """First headline, description and CTA, all hashtags and unique keywords"""
+        headline = description = cta = ''
+        hashtags = []
+        keywords = []
+        for key, value in self.sections.items():
+            if isinstance(value, ContentSection):
+                headline = headline or value._first(value.HEADLINES)
+                description = description or value._first(value.DESCRIPTIONS)
+                cta = cta or value._first(value.CTAS)
+                hashtags = hashtags or value._all(value.HASHTAGS)
+                keywords.extend(value._all(value.KEYWORDS))
+            elif isinstance(value, list) and value:
+                if 'headline' in key and not headline:
+                    headline = str(value[0])
+                elif 'hashtag' in key:
+                    hashtags = [str(item) for item in value]
+                elif 'keyword' in key:
+                    keywords.extend(str(item) for item in value)
+        return {
+            'headline': headline,
+            'description': description,
+            'cta': cta,
+            'hashtags': hashtags,
+            'keywords': list(dict.fromkeys(keywords))
+        }
+
+# =============================================================================
+# NEAR-DUPLICATE SUPPRESSION (MINHASH / LSH)
+# =============================================================================
+
+# 32 MinHash permutations split into 8 LSH bands of 4 rows. Within a result two
+# items are near-duplicates when their signatures agree on MINHASH_THRESHOLD of
+# positions; against history, when MINHASH_MIN_BANDS bands of one past item hit
+# the index (both correspond to a character 4-gram Jaccard similarity of about 0.6-0.65).
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 8
+MINHASH_SHINGLE = 4
+MINHASH_THRESHOLD = 0.6
+MINHASH_MIN_BANDS = 2
+_MINHASH_PRIME = 4294967291
+_minhash_rng = np.random.default_rng(0x5EED)
+_MINHASH_A = _minhash_rng.integers(1, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _minhash_rng.integers(0, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def minhash_signature(text):
+    """MinHash signature (uint32 array) of the character shingles of text"""
+    normalized = ' '.join(re.findall(r'[a-z0-9]+', str(text).lower()))
+    shingles = {
+        normalized[i:i + MINHASH_SHINGLE]
+        for i in range(max(1, len(normalized) - MINHASH_SHINGLE + 1))
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+    )
+    return ((np.outer(_MINHASH_A, hashes) + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1).astype(np.uint32)
+
+def minhash_band_keys(scope, signature):
+    """One signed 64-bit LSH key per band, namespaced by scope (the business)"""
+    scope = scope.strip().lower().encode('utf-8')
+    return [
+        int.from_bytes(
+            hashlib.blake2b(scope + bytes([band]) + rows.tobytes(), digest_size=8).digest(),
+            'big', signed=True
+        )
+        for band, rows in enumerate(signature.reshape(MINHASH_BANDS, -1))
+    ]
+
+def minhash_item_id(scope, signature):
+    """Signed 64-bit id of one indexed item: its scope and signature"""
+    return int.from_bytes(
+        hashlib.blake2b(scope.strip().lower().encode('utf-8') + b'\0' + signature.tobytes(), digest_size=8).digest(),
+        'big', signed=True
+    )
+
+def history_dedupe_texts(outputs):
+    """Headlines and captions of a flattened history record"""
+    texts = []
+    for column in ('headlines', 'captions'):
+        try:
+            values = json.loads(outputs.get(column) or '[]')
+        except (TypeError, json.JSONDecodeError):
+            continue
+        if isinstance(values, list):
+            texts.extend(str(value) for value in values if isinstance(value, str) and value)
+    return texts
+
+def index_history_texts(cursor, scope, texts):
+    """Add the LSH keys of texts to the history index (inside the caller's transaction)"""
+    rows = []
+    for text in texts:
+        signature = minhash_signature(text)
+        item_id = minhash_item_id(scope, signature)
+        rows.extend((key, item_id) for key in minhash_band_keys(scope, signature))
+    cursor.executemany('INSERT OR IGNORE INTO headline_minhash (band_key, item_id) VALUES (?, ?)', rows)
+
+
+class NearDuplicateIndex:
+    """LSH index over past headlines and captions, stored in SQLite.
+    
+    Each past item stores one (band_key, item_id) row per band, keyed on
+    band_key first, so a lookup is MINHASH_BANDS b-tree seeks regardless of
+    history size and nothing is held in memory. A match needs min_bands
+    bands of the same item; hits spread over unrelated items do not count.
+    save_to_history adds new rows as they are written; rows saved before
+    the index existed are backfilled once per process (see warm).
+    """
+    
+    def __init__(self, pool=None, min_bands=MINHASH_MIN_BANDS, backfill=True):
+        self.pool = pool or get_database_pool()
+        self.min_bands = min_bands
+        self.backfilled = None
+        if backfill:
+            self.backfill()
+    
+    def warm(self, executor):
+        """Run the backfill on executor; the index is not ready until it finishes"""
+        self.backfilled = executor.submit(self.backfill)
+        return self
+    
+    @property
+    def ready(self):
+        """False while a backfill submitted by warm is still running"""
+        return self.backfilled is None or self.backfilled.done()
+    
+    def backfill(self, batch_size=1000):
+        """Index content_history rows added since the last backfill; returns rows indexed"""
+        codec = get_result_codec(self.pool.db_path)
+        indexed = 0
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            row = cursor.execute('SELECT last_history_id FROM headline_minhash_state WHERE id = 1').fetchone()
+            last_id = row[0] if row else 0
+            
+            while True:
+                rows = cursor.execute(
+                    'SELECT id, business_name, headlines, full_response, dict_id, result_blob FROM content_history '
+                    'WHERE id > ? ORDER BY id LIMIT ?',
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                for history_id, business_name, headlines, full_response, dict_id, blob in rows:
+                    outputs = dict(history_outputs(history_payload(codec, conn, dict_id, blob, full_response)))
+                    if headlines:
+                        outputs.setdefault('headlines', headlines)
+                    index_history_texts(cursor, business_name or '', history_dedupe_texts(outputs))
+                    last_id = history_id
+                cursor.execute(
+                    'INSERT OR REPLACE INTO headline_minhash_state (id, last_history_id) VALUES (1, ?)', (last_id,)
+                )
+                conn.commit()
+                indexed += len(rows)
+        return indexed
+    
+    def seen(self, scope, signature):
+        """True if a near-duplicate of signature was saved before for scope"""
+        keys = minhash_band_keys(scope, signature)
+        with self.pool.connection() as conn:
+            match = conn.execute(
+                f'SELECT 1 FROM headline_minhash WHERE band_key IN ({",".join("?" * len(keys))}) '
+                'GROUP BY item_id HAVING COUNT(*) >= ? LIMIT 1',
+                (*keys, self.min_bands)
+            ).fetchone()
+        return match is not None
+
+@st.cache_resource
+def get_near_duplicate_index():
+    """Process-wide near-duplicate index; backfills history in the background on first use"""
+    return NearDuplicateIndex(backfill=False).warm(get_background_executor())
+
+def suppress_near_duplicates(result, scope, index=None, threshold=MINHASH_THRESHOLD, min_keep=3):
+    """Drop near-duplicate headlines and captions from result in place.
+    
+    Within each list a later item is dropped when it is a near-duplicate of
+    an earlier kept one. With an index, items already saved for the same
+    business are dropped as well, but never below min_keep items per list
+    (a cached or repeated generation still shows something). Returns the
+    number of items removed.
+    """
+    removed = 0
+    for section in result.sections.values():
+        if not isinstance(section, ContentSection):
+            continue
+        for name in section.DEDUPE:
+            items = getattr(section, name)
+            if len(items) < 2 and index is None:
+                continue
+            
+            kept = []
+            signatures = []
+            for item in items:
+                signature = minhash_signature(item)
+                if signatures and (np.stack(signatures) == signature).mean(axis=1).max() >= threshold:
+                    continue
+                kept.append(item)
+                signatures.append(signature)
+            
+            if index is not None and kept:
+                repeated = [index.seen(scope, signature) for signature in signatures]
+                # Earliest repeats are kept back when too few fresh items remain.
+                spare = max(0, min(min_keep, len(kept)) - repeated.count(False))
+                fresh = []
+                for item, old in zip(kept, repeated):
+                    if old:
+                        if not spare:
+                            continue
+                        spare -= 1
+                    fresh.append(item)
+                kept = fresh
+            
+            removed += len(items) - len(kept)
+            setattr(section, name, kept)
+    return removed
+
+# =============================================================================
+# COPY RANKING
+# =============================================================================
+
+POWER_WORDS = tuple(
+    word.strip().lower()
+    for word in re.search(r'POWER WORDS TO USE:(.*)', PromptTemplates.GOOGLE_ADS).group(1).split(',')
+)
+URGENCY_TERMS = (
+    'now', 'today', 'limited', 'hurry', 'only', 'last chance', 'ends', 'ending', 'left',
+    'before', 'deadline', 'tonight', 'this week', 'expires', 'don t miss'
+)
+
+# Feature weights per role: length fit, power words, numbers, urgency, keyword coverage.
+RANKING_WEIGHTS = {
+    'headline': (0.30, 0.20, 0.15, 0.10, 0.25),
+    'description': (0.25, 0.15, 0.10, 0.10, 0.40),
+    'cta': (0.40, 0.30, 0.00, 0.30, 0.00),
+    'caption': (0.20, 0.20, 0.10, 0.10, 0.40)
+}
+RANKING_DEFAULT_LIMITS = {
+    'headline': (None, 40),
+    'description': (None, 125),
+    'cta': (None, 25),
+    'caption': (None, 300)
+}
+# "section.field" -> (min_chars, max_chars) in the shape of a merged result
+RANKING_LIMITS = {
+    (path if '.' in path else f'{prompt_type}.{path}'): limits
+    for prompt_type, schema in CONTENT_SCHEMAS.items() if not prompt_type.startswith('multi_platform.')
+    for path, limits in schema['limits'].items()
+}
+
+
+class CopyRanker:
+    """Scores copy variants in one vectorized pass.
+    
+    Every text becomes a row of five features in [0, 1]: how close its length
+    is to 85% of its limit (0 when over), power words from the Google Ads
+    prompt, a number, urgency terms and coverage of the business keywords.
+    A role-specific weighted sum is the score; going over the character
+    limit costs a full point so such variants always sink.
+    """
+    
+    def __init__(self, keywords=()):
+        self.keywords = tuple(dict.fromkeys(str(keyword).lower() for keyword in keywords if keyword))
+    
+    @staticmethod
+    def _normalize(texts):
+        return np.array([' ' + ' '.join(re.findall(r'[a-z0-9]+', str(text).lower())) + ' ' for text in texts])
+    
+    def score(self, texts, roles, min_chars, max_chars):
+        """Scores for texts; roles/min_chars/max_chars are per-text arrays (NaN = no bound)"""
+        if not len(texts):
+            return np.zeros(0)
+        normalized = self._normalize(texts)
+        lengths = np.fromiter((len(str(text)) for text in texts), dtype=float, count=len(texts))
+        
+        def hits(terms, padded=True):
+            if not terms:
+                return np.zeros((len(texts), 0), dtype=bool)
+            needles = np.array([f' {term} ' if padded else term for term in terms])
+            return np.char.find(normalized[:, None], needles[None, :]) >= 0
+        
+        target = np.where(np.isnan(max_chars), 60.0, 0.85 * np.nan_to_num(max_chars, nan=60.0))
+        length_fit = np.clip(1 - np.abs(lengths - target) / target, 0, 1)
+        over = ~np.isnan(max_chars) & (lengths > np.nan_to_num(max_chars, nan=np.inf))
+        under = ~np.isnan(min_chars) & (lengths < np.nan_to_num(min_chars, nan=0.0))
+        length_fit[over] = 0.0
+        length_fit[under] *= 0.5
+        
+        features = np.column_stack([
+            length_fit,
+            np.minimum(hits(POWER_WORDS).sum(axis=1), 2) / 2,
+            hits(tuple('0123456789'), padded=False).any(axis=1),
+            hits(URGENCY_TERMS).any(axis=1),
+            (np.minimum(hits(self.keywords).sum(axis=1), 3) / min(3, len(self.keywords))
+             if self.keywords else np.zeros(len(texts)))
+        ]).astype(float)
+        
+        weights = np.array([RANKING_WEIGHTS[role] for role in roles])
+        return (features * weights).sum(axis=1) - over
+    
+    def rank_result(self, result):
+        """Reorder headline/description/CTA/caption lists of result best-first, in place"""
+        groups = []
+        for key, section in result.items():
+            if not isinstance(section, ContentSection):
+                continue
+            for role, names in (('headline', section.HEADLINES), ('description', section.DESCRIPTIONS),
+                                ('cta', section.CTAS), ('caption', ('captions',) if hasattr(section, 'captions') else ())):
+                for name in names:
+                    items = getattr(section, name)
+                    if isinstance(items, list) and len(items) > 1:
+                        limits = RANKING_LIMITS.get(f'{key}.{name}', RANKING_DEFAULT_LIMITS[role])
+                        groups.append((section, name, role, limits, items))
+        if not groups:
+            return 0
+        
+        texts = [item for *_, items in groups for item in items]
+        roles = [role for _, _, role, _, items in groups for _ in items]
+        bounds = np.array(
+            [limits for _, _, _, limits, items in groups for _ in items], dtype=float
+        )
+        scores = self.score(texts, roles, bounds[:, 0], bounds[:, 1])
+        
+        offset = 0
+        for section, name, _, _, items in groups:
+            order = np.argsort(-scores[offset:offset + len(items)], kind='stable')
+            setattr(section, name, [items[i] for i in order])
+            offset += len(items)
+        return len(texts)
+
+# =============================================================================
+# FEW-SHOT EXEMPLARS
+# =============================================================================
+
+def _exemplar_line(outputs):
+    """One compact exemplar (best headline / description / caption) from a history record"""
+    parts = []
+    for columns, limit in ((('headlines', 'seo_title'), 60), (('descriptions', 'meta_description'), 120),
+                           (('captions',), 120)):
+        for column in columns:
+            try:
+                values = json.loads(outputs.get(column) or '[]')
+            except (TypeError, json.JSONDecodeError):
+                continue
+            text = next((value for value in values if isinstance(value, str) and value.strip()), None) \
+                if isinstance(values, list) else None
+            if text:
+                text = ' '.join(text.split())
+                parts.append(json.dumps(text if len(text) <= limit else text[:limit - 1] + '…', ensure_ascii=False))
+                break
+    return ' / '.join(parts)
+
+def index_exemplar(cursor, history_id, inputs, outputs):
+    """Precompute the exemplar line for one history row (inside the caller's transaction)"""
+    business_type = ' '.join(str(inputs.get('business_type') or '').lower().split())
+    line = _exemplar_line(outputs)
+    if not business_type or not line:
+        return
+    ranker = CopyRanker()
+    headline = line.split(' / ')[0]
+    score = float(ranker.score([json.loads(headline)], ['headline'], np.array([np.nan]), np.array([30.0]))[0])
+    cursor.execute(
+        'INSERT OR REPLACE INTO exemplar_index '
+        '(history_id, business_type, tone, business_name, line, tokens, score) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (history_id, business_type, inputs.get('tone') or '', inputs.get('business_name') or '',
+         line, estimate_tokens(line), score)
+    )
+
+
+class ExemplarIndex:
+    """Top past outputs per business type and tone, for few-shot prompting.
+    
+    save_to_history stores one precomputed line per generation (its best
+    headline, description and caption) with a quality score, so retrieval
+    is a single indexed query. Rows saved before the index existed are
+    backfilled once per process (see warm).
+    """
+    
+    def __init__(self, pool=None, backfill=True):
+        self.pool = pool or get_database_pool()
+        self.backfilled = None
+        if backfill:
+            self.backfill()
+    
+    def warm(self, executor):
+        """Run the backfill on executor; the index is not ready until it finishes"""
+        self.backfilled = executor.submit(self.backfill)
+        return self
+    
+    @property
+    def ready(self):
+        """False while a backfill submitted by warm is still running"""
+        return self.backfilled is None or self.backfilled.done()
+    
+    def backfill(self, batch_size=1000):
+        """Index content_history rows added since the last backfill; returns rows read"""
+        codec = get_result_codec(self.pool.db_path)
+        read = 0
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            row = cursor.execute('SELECT last_history_id FROM exemplar_index_state WHERE id = 1').fetchone()
+            last_id = row[0] if row else 0
+            
+            while True:
+                rows = cursor.execute(
+                    'SELECT id, business_name, business_type, tone, full_response, dict_id, result_blob FROM content_history '
+                    'WHERE id > ? ORDER BY id LIMIT ?',
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                for history_id, business_name, business_type, tone, full_response, dict_id, blob in rows:
+                    outputs = history_outputs(history_payload(codec, conn, dict_id, blob, full_response))
+                    if outputs:
+                        index_exemplar(cursor, history_id,
+                                       {'business_name': business_name, 'business_type': business_type, 'tone': tone},
+                                       outputs)
+                    last_id = history_id
+                cursor.execute(
+                    'INSERT OR REPLACE INTO exemplar_index_state (id, last_history_id) VALUES (1, ?)', (last_id,)
+                )
+                conn.commit()
+                read += len(rows)
+        return read
+    
+    def retrieve(self, inputs, k=3, token_budget=150):
+        """Best k exemplar lines for the same business type and tone, within token_budget.
+        
+        The business itself is excluded so the model is not nudged into
+        repeating its own earlier copy.
+        """
+        business_type = ' '.join(str(inputs.get('business_type') or '').lower().split())
+        if not business_type or k <= 0:
+            return []
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                'SELECT line, tokens FROM exemplar_index WHERE business_type = ? AND tone = ? AND business_name != ? '
+                'ORDER BY score DESC, history_id DESC LIMIT ?',
+                (business_type, inputs.get('tone') or '', inputs.get('business_name') or '', k * 4)
+            ).fetchall()
+        
+        lines = []
+        spent = 0
+        for line, tokens in rows:
+            if line in lines or spent + tokens > token_budget:
+                continue
+            lines.append(line)
+            spent += tokens
+            if len(lines) == k:
+                break
+        return lines
+
+@st.cache_resource
+def get_exemplar_index():
+    """Process-wide exemplar index; backfills history in the background on first use"""
+    return ExemplarIndex(backfill=False).warm(get_background_executor())
+
+def format_exemplars(lines):
+    """Prompt block for retrieved exemplars ('' when there are none)"""
+    if not lines:
+        return ''
+    return (
+        "STRONG PAST COPY FOR THIS BUSINESS TYPE AND TONE (match the quality, do not copy):\n"
+        + '\n'.join(f"- {line}" for line in lines) + "\n\n"
+    )
+
+# =============================================================================
+# SIMILARITY CACHE
+# =============================================================================
+
+SimilarMatch = namedtuple('SimilarMatch', ['score', 'result', 'inputs', 'created_at'])
+
+
+class SimilarityCache:
+    """Reuses results generated for near-identical business inputs.
+    
+    Inputs must match exactly on business name, platforms, tone and model;
+    the free-text fields (business type, product/service, audience, offer)
+    are compared by TF-IDF cosine similarity over word unigrams and bigrams.
+    Term vectors and document frequencies are stored in SQLite, so IDF
+    weights follow the traffic actually seen. Each exact-match bucket keeps
+    its ``per_bucket`` most recent results; rows older than ``ttl_seconds``
+    are purged on store and never count towards the IDF statistics.
+    """
+    
+    TEXT_FIELDS = ('business_type', 'product_service', 'target_audience', 'offer')
+    
+    def __init__(self, pool=None, per_bucket=50, ttl_seconds=30 * 24 * 3600):
+        self.pool = pool or get_database_pool(RESPONSE_CACHE_DB_PATH)
+        self.per_bucket = per_bucket
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        with self.pool.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS similar_inputs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bucket TEXT NOT NULL,
+                    terms TEXT NOT NULL,
+                    inputs TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_similar_inputs_bucket ON similar_inputs (bucket, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_similar_inputs_created ON similar_inputs (created_at)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS similar_terms (
+                    term TEXT PRIMARY KEY,
+                    df INTEGER NOT NULL
+                )
+            ''')
+    
+    @staticmethod
+    def bucket(inputs, model):
+        """Exact-match part of the fingerprint"""
+        platforms = inputs.get('platform') or []
+        if isinstance(platforms, str):
+            platforms = [p.strip() for p in platforms.split(',')]
+        payload = json.dumps([
+            ' '.join(str(inputs.get('business_name', '')).lower().split()),
+            sorted(platforms),
+            inputs.get('tone', ''),
+            model
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def term_counts(cls, inputs):
+        """Word unigram and bigram counts of the free-text fields, prefixed by field"""
+        counts = Counter()
+        for name in cls.TEXT_FIELDS:
+            words = re.findall(r'[a-z0-9]+', str(inputs.get(name, '')).lower())
+            counts.update(f"{name}:{word}" for word in words)
+            counts.update(f"{name}:{a}_{b}" for a, b in zip(words, words[1:]))
+        return counts
+    
+    @staticmethod
+    def _document_frequencies(conn, terms):
+        terms = list(terms)
+        df = {}
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            df.update(conn.execute(
+                f'SELECT term, df FROM similar_terms WHERE term IN ({",".join("?" * len(chunk))})', chunk
+            ).fetchall())
+        return df
+    
+    @staticmethod
+    def _weights(counts, df, total):
+        """L2-normalised sublinear TF-IDF vector (df is capped at total, so IDF stays >= 1)"""
+        vector = {
+            term: (1 + np.log(count)) * (np.log((total + 1) / (min(df.get(term, 0), total) + 1)) + 1)
+            for term, count in counts.items()
+        }
+        norm = np.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {term: weight / norm for term, weight in vector.items()}
+    
+    def lookup(self, inputs, model, threshold=0.9):
+        """Return the most similar stored SimilarMatch at or above threshold, or None"""
+        counts = self.term_counts(inputs)
+        cutoff = time.time() - self.ttl_seconds
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                'SELECT terms, inputs, result, created_at FROM similar_inputs '
+                'WHERE bucket = ? AND created_at >= ? ORDER BY id DESC LIMIT ?',
+                (self.bucket(inputs, model), cutoff, self.per_bucket)
+            ).fetchall()
+            best = None
+            if rows and counts:
+                total = conn.execute('SELECT COUNT(*) FROM similar_inputs WHERE created_at >= ?', (cutoff,)).fetchone()[0]
+                candidates = [(Counter(json.loads(row[0])),) + tuple(row[1:]) for row in rows]
+                df = self._document_frequencies(
+                    conn, set(counts).union(*(stored_counts for stored_counts, *_ in candidates))
+                )
+                query = self._weights(counts, df, total)
+                for stored_counts, stored_inputs, result, created_at in candidates:
+                    stored = self._weights(stored_counts, df, total)
+                    score = sum(weight * stored.get(term, 0.0) for term, weight in query.items())
+                    if score >= threshold and (best is None or score > best[0]):
+                        best = (score, result, stored_inputs, created_at)
+        
+        with self._lock:
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        score, result, stored_inputs, created_at = best
+        return SimilarMatch(float(score), ContentResult.from_json(result), json.loads(stored_inputs), created_at)
+    
+    def store(self, inputs, model, result):
+        """Remember result for inputs and update the document frequencies"""
+        counts = self.term_counts(inputs)
+        bucket = self.bucket(inputs, model)
+        now = time.time()
+        with self.pool.transaction() as cursor:
+            cursor.execute(
+                'INSERT INTO similar_inputs (bucket, terms, inputs, result, created_at) VALUES (?, ?, ?, ?, ?)',
+                (bucket, json.dumps(counts), json.dumps(inputs, ensure_ascii=False),
+                 ContentResult.from_dict(result).to_json(), now)
+            )
+            cursor.executemany(
+                'INSERT INTO similar_terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1',
+                [(term,) for term in counts]
+            )
+            # Expired rows in any bucket and rows past this bucket's limit.
+            trimmed = cursor.execute(
+                'SELECT id, terms FROM similar_inputs WHERE created_at < ? '
+                'UNION SELECT id, terms FROM similar_inputs WHERE bucket = ? AND id NOT IN '
+                '(SELECT id FROM similar_inputs WHERE bucket = ? ORDER BY id DESC LIMIT ?)',
+                (now - self.ttl_seconds, bucket, bucket, self.per_bucket)
+            ).fetchall()
+            if trimmed:
+                # Removed rows no longer count towards document frequencies.
+                gone = Counter(term for _, terms in trimmed for term in json.loads(terms))
+                cursor.executemany('UPDATE similar_terms SET df = df - ? WHERE term = ?',
+                                   [(count, term) for term, count in gone.items()])
+                cursor.execute('DELETE FROM similar_terms WHERE df <= 0')
+                cursor.executemany('DELETE FROM similar_inputs WHERE id = ?', [(row_id,) for row_id, _ in trimmed])
+    
+    def clear(self):
+        with self.pool.transaction() as cursor:
+            cursor.execute('DELETE FROM similar_inputs')
+            cursor.execute('DELETE FROM similar_terms')
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        with self.pool.connection() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM similar_inputs').fetchone()[0]
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+@st.cache_resource
+def get_similarity_cache():
+    """Process-wide similarity cache shared by all sessions and reruns"""
+    return SimilarityCache()
+
+# =============================================================================
+# LLM CONTENT GENERATION ENGINE (GROQ - FREE)
+# =============================================================================
+
+class JSONSectionStream:
+    """Incremental parser that yields top-level JSON members as they close.
+    
+    Text is fed in arbitrary chunks. The scanner keeps string/escape state and
+    nesting depth across chunks, so each top-level ``"key": value`` pair of the
+    outermost object is decoded exactly once, as soon as its closing bracket
+    (or the following comma for scalar values) has arrived.
+    """
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member = []
+        self.done = False
+    
+    def feed(self, text):
+        """Consume a chunk and return the list of (key, value) pairs completed by it"""
+        sections = []
+        for char in text:
+            if self.done:
+                break
+            
+            if self.depth == 0:
+                if char == '{':
+                    self.depth = 1
+                continue
+            
+            if self.in_string:
+                self.member.append(char)
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            
+            if char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    self._emit(sections)
+                    self.done = True
+                    continue
+                if self.depth == 1:
+                    self.member.append(char)
+                    self._emit(sections)
+                    continue
+            elif char == ',' and self.depth == 1:
+                self._emit(sections)
+                continue
+            
+            self.member.append(char)
+        
+        return sections
+    
+    def _emit(self, sections):
+        text = ''.join(self.member).strip()
+        self.member = []
+        if not text:
+            return
+        try:
+            parsed = json.loads('{' + text + '}')
+        except json.JSONDecodeError:
+            return
+        sections.extend(parsed.items())
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+CASCADE_FAST_MODEL = "llama-3.1-8b-instant"
+
+# "All Platforms" mode selection: assumed (overhead_s, seconds_per_token) until
+# the backend has been measured, typical reply size, and the predicted
+# parallel/monolithic time ratio below which parallel sections are used.
+DECODE_PRIOR = (0.5, 0.004)
+MULTI_PLATFORM_TYPICAL_TOKENS = 2500
+MULTI_PLATFORM_MAX_TOKENS = 6000
+MULTI_PLATFORM_SECTION_TOKENS = 2000
+MULTI_PLATFORM_WORKERS = 7
+PARALLEL_MIN_SPEEDUP_RATIO = 0.7
+
+SYSTEM_PROMPT = "You are an expert marketing copywriter who creates HIGH-CONVERTING content. Always respond with valid JSON only. No markdown, no code blocks, no explanations - just pure JSON that can be parsed directly."
+
+class ContentGenerator:
+    """Main content generation engine using Groq (FREE & FAST)"""
+    
+    def __init__(self, api_key, cache=None, use_cache=True, client=None, scheduler=None, router=None, sizer=None,
+                 model=DEFAULT_MODEL, cascade_router=None, counters=None, compact_prompts=True,
+                 enforce_limits=True, multi_platform_mode='auto', exemplars=None, exemplar_k=3,
+                 exemplar_token_budget=150, singleflight=None):
+        self.api_key = api_key
+        self.client = client if client is not None or router is not None else Groq(api_key=api_key)
+        self.model = model
+        self.temperature = 0.8
+        self.cache = cache
+        self.use_cache = use_cache
+        self.scheduler = scheduler
+        if router is None:
+            router = LatencyRouter([GroqProvider(self.client, self.model, scheduler, api_key)], LatencyTracker())
+        self.router = router
+        self.sizer = sizer
+        # Optional fast first pass; only sections failing validation go to router.
+        self.cascade_router = cascade_router
+        self.cascade_model = cascade_router.providers[0].model if cascade_router is not None else None
+        self.counters = counters
+        # Send minified schemas instead of the commented, indented originals.
+        self.compact_prompts = compact_prompts
+        # Rewrite items that break the prompts' character limits in one follow-up.
+        self.enforce_limits = enforce_limits
+        # 'auto', 'monolithic' or 'parallel' for "All Platforms".
+        self.multi_platform_mode = multi_platform_mode
+        # Optional ExemplarIndex for few-shot examples from history.
+        self.exemplars = exemplars
+        self.exemplar_k = exemplar_k
+        self.exemplar_token_budget = exemplar_token_budget
+        # Optional SingleFlight so identical concurrent requests share one call.
+        self.singleflight = singleflight
+    
+    @staticmethod
+    def _parse_json(content):
+        """Extract the JSON object from a reply, repairing common defects"""
+        return parse_json_response(content)
+    
+    def _parse_completion(self, completion):
+        """Parse a completion; a truncated or unrepairable reply yields None"""
+        if completion.finish_reason == 'length':
+            return None
+        try:
+            return self._parse_json(completion.text)
+        except json.JSONDecodeError:
+            return None
+    
+    def _repair_with_model(self, text):
+        """Ask the model to fix only the broken JSON fragment, not regenerate it"""
+        try:
+            return self._parse_json(text)
+        except UnrepairableJSON as e:
+            fragment = e.fragment
+        
+        prompt = f"Fix this JSON so it parses. Keep every key and value; only correct the syntax.\n\n{fragment}"
+        completion, result = self.router.complete(
+            REPAIR_SYSTEM_PROMPT,
+            prompt,
+            min(8000, estimate_tokens(fragment) + 512),
+            0.0,
+            validate=self._parse_completion
+        )
+        if result is None:
+            return self._parse_json(completion.text)
+        return result
+    
+    def _generate(self, prompt, max_tokens=4000, use_cache=None, on_section=None, prompt_type=None):
+        """Call the model and parse its JSON reply, raising on any failure.
+        
+        With a cache attached, identical requests are answered from it unless
+        use_cache (or self.use_cache) is False; a bypassed request still
+        refreshes the stored entry. When on_section is given the completion is
+        streamed and on_section(key, value) is called for every top-level
+        section as soon as it is complete.
+        
+        With a sizer attached and a prompt_type given, max_tokens is only the
+        ceiling: the request starts at the adaptive cap and is retried at
+        twice the cap (up to the ceiling) only when the reply was truncated.
+        
+        With a singleflight attached, concurrent identical requests that miss
+        the cache share one model call; late joiners get the sections replayed.
+        """
+        if use_cache is None:
+            use_cache = self.use_cache
+        
+        model = self.model if self.cascade_router is None else f"{self.cascade_model}>{self.model}"
+        request_key = ResponseCache.make_key(model, SYSTEM_PROMPT, prompt, max_tokens, self.temperature)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = request_key
+            if use_cache:
+                try:
+                    cached = self.cache.get(cache_key)
+                except sqlite3.Error as e:
+                    logger.warning("response cache read failed: %s", e)
+                    cached = None
+                if cached is not None:
+                    if on_section is not None and isinstance(cached, dict):
+                        for key, value in cached.items():
+                            on_section(key, value)
+                    return cached
+        
+        if self.singleflight is None:
+            return self._generate_uncached(prompt, max_tokens, on_section, prompt_type, cache_key)
+        
+        flight_key = (
+            request_key,
+            prompt_type if prompt_type in CONTENT_SCHEMAS else None,
+            self.enforce_limits
+        )
+        result, shared = self.singleflight.do(
+            flight_key,
+            lambda: self._generate_uncached(prompt, max_tokens, on_section, prompt_type, cache_key)
+        )
+        if shared:
+            if self.counters is not None:
+                self.counters.incr('requests_coalesced')
+            if on_section is not None and isinstance(result, dict):
+                for key, value in result.items():
+                    on_section(key, value)
+        return result
+    
+    def _generate_uncached(self, prompt, max_tokens, on_section, prompt_type, cache_key):
+        """Run the model call behind _generate and store the parsed result"""
+        if self.cascade_router is not None and prompt_type in CONTENT_SCHEMAS:
+            result = self._generate_cascade(prompt, max_tokens, on_section, prompt_type)
+        else:
+            result = self._complete_json(prompt, max_tokens, on_section, prompt_type, self.router)
+        
+        if self.enforce_limits and prompt_type in CONTENT_SCHEMAS:
+            self._enforce_limits(result, prompt_type, on_section)
+        
+        if cache_key is not None:
+            # The generation is already paid for; a failed cache write must not lose it.
+            try:
+                self.cache.set(cache_key, result)
+            except sqlite3.Error as e:
+                logger.warning("response cache write failed: %s", e)
+                if self.counters is not None:
+                    self.counters.incr('cache_write_errors')
+        return result
+    
+    def _complete_json(self, prompt, max_tokens, on_section, prompt_type, router):
+        """Run one prompt on router with adaptive sizing, truncation retry and repair"""
+        sized = self.sizer is not None and prompt_type is not None
+        cap = self.sizer.size(prompt_type, max_tokens) if sized else max_tokens
+        
+        result = None
+        if on_section is not None:
+            usage = {}
+            text = self._stream(prompt, cap, on_section, router, usage)
+            try:
+                result = self._parse_json(text)
+            except json.JSONDecodeError:
+                if cap >= max_tokens:
+                    result = self._repair_with_model(text)
+                else:
+                    # Most likely cut off by the adaptive cap; finish without streaming.
+                    cap = max_tokens
+            # Only backend-reported usage is recorded; estimates would skew the p99.
+            if result is not None and sized and usage.get('completion_tokens'):
+                self._record_completion(prompt_type, usage['completion_tokens'], result,
+                                        usage.get('finish_reason') == 'length')
+        
+        while result is None:
+            completion, result = router.complete(
+                SYSTEM_PROMPT, prompt, cap, self.temperature, validate=self._parse_completion
+            )
+            truncated = completion.finish_reason == 'length'
+            if sized:
+                self._record_completion(prompt_type, completion.completion_tokens, result, truncated)
+            if result is None:
+                if truncated and cap < max_tokens:
+                    cap = min(max_tokens, cap * 2)
+                    continue
+                result = self._repair_with_model(completion.text)
+        
+        return result
+    
+    def _record_completion(self, prompt_type, completion_tokens, result, truncated=False):
+        """Record a completion length; a full "All Platforms" reply also seeds its sections.
+        
+        Parallel sections are only chosen once their reservations fit the
+        rate limit, which needs section samples, so until sections have run
+        on their own they are sized from the monolithic reply split by the
+        serialized length of each section.
+        """
+        self.sizer.record(prompt_type, completion_tokens, truncated=truncated)
+        if prompt_type != 'multi_platform' or truncated or not isinstance(result, dict):
+            return
+        self.sizer.seed(completion_tokens, {
+            f'multi_platform.{section}': len(json.dumps(result[section], ensure_ascii=False))
+            for section in CONTENT_SCHEMAS['multi_platform']['sections'] if section in result
+        })
+    
+    def _generate_cascade(self, prompt, max_tokens, on_section, prompt_type):
+        """Generate on the fast model, then re-request only failing sections on the main one"""
+        result = self._complete_json(prompt, max_tokens, on_section, prompt_type, self.cascade_router)
+        failing = failing_sections(prompt_type, result)
+        
+        counters = self.counters
+        if counters is not None:
+            counters.incr('cascade_requests')
+            counters.incr('cascade_sections', len(CONTENT_SCHEMAS[prompt_type]['sections']))
+            counters.incr('cascade_escalated_sections', len(failing))
+        if not failing:
+            return result
+        if counters is not None:
+            counters.incr('cascade_escalated_requests')
+        
+        followup = (
+            f"{prompt}\n\nReturn ONLY a JSON object with these keys: {', '.join(failing)}. "
+            "Follow every character limit above exactly."
+        )
+        fixed = self._complete_json(followup, max_tokens, None, None, self.router)
+        if not isinstance(result, dict):
+            return fixed
+        for key in failing:
+            if key in fixed:
+                result[key] = fixed[key]
+                if on_section is not None:
+                    on_section(key, fixed[key])
+        return result
+    
+    def _enforce_limits(self, result, prompt_type, on_section=None):
+        """Rewrite only the items outside their character limits and splice them back.
+        
+        All violations go out in a single small request (on the fast cascade
+        model when one is configured). Rewrites that still miss their limit
+        are dropped, and a failed request leaves result unchanged.
+        """
+        violations = find_length_violations(prompt_type, result)
+        if not violations:
+            return
+        
+        prompt = build_rewrite_prompt(violations)
+        router = self.cascade_router or self.router
+        try:
+            _, rewrites = router.complete(
+                REWRITE_SYSTEM_PROMPT,
+                prompt,
+                min(4000, estimate_tokens(prompt) + 256),
+                0.3,
+                validate=self._parse_completion
+            )
+        except Exception:
+            rewrites = None
+        
+        changed = apply_rewrites(result, violations, rewrites)
+        
+        counters = self.counters
+        if counters is not None:
+            counters.incr('limit_violations', len(violations))
+            counters.incr('limit_fixes', len(violations) - len(find_length_violations(prompt_type, result)))
+        if on_section is not None:
+            for key in changed:
+                on_section(key, result[key])
+    
+    def _stream(self, prompt, max_tokens, on_section, router, usage=None):
+        """Consume a streamed completion, emitting sections as they close"""
+        parser = JSONSectionStream()
+        parts = []
+        for delta in router.stream(SYSTEM_PROMPT, prompt, max_tokens, self.temperature, usage):
+            parts.append(delta)
+            for key, value in parser.feed(delta):
+                on_section(key, value)
+        
+        return ''.join(parts)
     
-    def generate_content(self, prompt, max_tokens=4000):
+    def generate_content(self, prompt, max_tokens=4000, use_cache=None, on_section=None, prompt_type=None):
         """Generate content using Groq API"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert marketing copywriter who creates HIGH-CONVERTING content. Always respond with valid JSON only. No markdown, no code blocks, no explanations - just pure JSON that can be parsed directly."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                max_tokens=max_tokens,
-                temperature=0.8
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            if content.startswith('```'):
-                content = re.sub(r'^```json?\n?', '', content)
-                content = re.sub(r'\n?```$', '', content)
-            
-            json_match = re.search(r'\{[\s\S]*\}', content)
-            if json_match:
-                content = json_match.group()
-            
-            return json.loads(content)
+            return self._generate(prompt, max_tokens, use_cache, on_section, prompt_type)
             
         except json.JSONDecodeError as e:
             st.error(f"Error parsing response: {e}")
@@ -1078,25 +4690,332 @@ class ContentGenerator:
             st.error(f"API Error: {e}")
             return None
     
+    def prompt_inputs(self, inputs):
+        """inputs with the few-shot exemplar block the prompts should carry"""
+        if 'exemplars' in inputs:
+            return inputs
+        block = ''
+        # A partly backfilled index would skew which exemplars are picked.
+        if self.exemplars is not None and self.exemplars.ready:
+            try:
+                block = format_exemplars(self.exemplars.retrieve(inputs, self.exemplar_k, self.exemplar_token_budget))
+            except sqlite3.Error:
+                block = ''
+        return dict(inputs, exemplars=block)
+    
     def generate_google_ads(self, inputs):
-        prompt = PromptTemplates.google_ads_prompt(inputs)
-        return self.generate_content(prompt)
+        inputs = self.prompt_inputs(inputs)
+        prompt = PromptTemplates.google_ads_prompt(inputs, self.compact_prompts)
+        return self.generate_content(prompt, prompt_type='google_ads')
     
     def generate_social_media(self, inputs):
-        prompt = PromptTemplates.facebook_instagram_prompt(inputs)
-        return self.generate_content(prompt)
+        inputs = self.prompt_inputs(inputs)
+        prompt = PromptTemplates.facebook_instagram_prompt(inputs, self.compact_prompts)
+        return self.generate_content(prompt, prompt_type='social')
     
     def generate_seo_content(self, inputs):
-        prompt = PromptTemplates.seo_content_prompt(inputs)
-        return self.generate_content(prompt)
+        inputs = self.prompt_inputs(inputs)
+        prompt = PromptTemplates.seo_content_prompt(inputs, self.compact_prompts)
+        return self.generate_content(prompt, prompt_type='seo')
     
     def generate_landing_page(self, inputs):
-        prompt = PromptTemplates.landing_page_prompt(inputs)
-        return self.generate_content(prompt)
+        inputs = self.prompt_inputs(inputs)
+        prompt = PromptTemplates.landing_page_prompt(inputs, self.compact_prompts)
+        return self.generate_content(prompt, prompt_type='landing_page')
+    
+    def reservation_tokens(self, prompt, max_tokens, prompt_type):
+        """Tokens the rate-limit scheduler reserves for one call of this prompt"""
+        cap = self.sizer.size(prompt_type, max_tokens) if self.sizer is not None else max_tokens
+        return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt) + cap
+    
+    def multi_platform_reservations(self, inputs):
+        """Scheduler reservations of the monolithic call and of each parallel section call"""
+        monolithic = self.reservation_tokens(
+            PromptTemplates.multi_platform_prompt(inputs, self.compact_prompts), MULTI_PLATFORM_MAX_TOKENS, 'multi_platform'
+        )
+        sections = [
+            self.reservation_tokens(
+                COMPILED_PROMPTS[f'multi_platform.{section}'].render(inputs, self.compact_prompts),
+                MULTI_PLATFORM_SECTION_TOKENS, f'multi_platform.{section}'
+            )
+            for section in CONTENT_SCHEMAS['multi_platform']['sections']
+        ]
+        return monolithic, sections
+    
+    def estimate_multi_platform_seconds(self, max_workers=MULTI_PLATFORM_WORKERS, inputs=None):
+        """Predicted wall time of one monolithic vs. parallel "All Platforms" run.
+        
+        Uses the fitted overhead and per-token decode time of the best-ranked
+        backend (a prior until enough requests have been measured) and the
+        typical completion length of the whole reply and of each section.
+        With a scheduler and inputs, the wait the rate-limit buckets would
+        impose on each mode's reservations is added.
+        """
+        provider = self.router.ranked()[0]
+        overhead, per_token = self.router.tracker.decode_model(provider.name) or DECODE_PRIOR
+        
+        sections = list(CONTENT_SCHEMAS['multi_platform']['sections'])
+        typical = self.sizer.typical if self.sizer is not None else (lambda prompt_type: None)
+        known = {section: typical(f'multi_platform.{section}') for section in sections}
+        total = typical('multi_platform')
+        if total is None and all(known.values()):
+            total = sum(known.values())
+        total = total or MULTI_PLATFORM_TYPICAL_TOKENS
+        longest = max(tokens or total / len(sections) for tokens in known.values())
+        
+        waves = -(-len(sections) // max(1, min(max_workers, len(sections))))
+        estimate = {
+            'monolithic': overhead + per_token * total,
+            'parallel': waves * (overhead + per_token * longest)
+        }
+        if self.scheduler is not None and inputs is not None:
+            monolithic, parallel = self.multi_platform_reservations(inputs)
+            estimate['monolithic'] += self.scheduler.predict_wait(self.api_key, 1, monolithic)
+            estimate['parallel'] += self.scheduler.predict_wait(self.api_key, len(parallel), sum(parallel))
+        return estimate
+    
+    def choose_multi_platform_mode(self, inputs=None):
+        """Return 'monolithic' or 'parallel' for "All Platforms" generation.
+        
+        In auto mode parallel sections are used when they are predicted to be
+        clearly faster, rate-limit waits included, and the scheduler's
+        reservations for all sections (prompt plus max_tokens each) fit in
+        its tokens/minute bucket.
+        """
+        if self.multi_platform_mode != 'auto':
+            return self.multi_platform_mode
+        
+        if self.scheduler is not None and inputs is not None:
+            _, sections = self.multi_platform_reservations(inputs)
+            if sum(sections) > self.scheduler.tokens_per_minute * self.scheduler.headroom:
+                return 'monolithic'
+        
+        estimate = self.estimate_multi_platform_seconds(inputs=inputs)
+        if estimate['parallel'] > PARALLEL_MIN_SPEEDUP_RATIO * estimate['monolithic']:
+            return 'monolithic'
+        return 'parallel'
+    
+    def generate_all_platforms(self, inputs, on_section=None):
+        inputs = self.prompt_inputs(inputs)
+        mode = self.choose_multi_platform_mode(inputs)
+        if self.counters is not None:
+            self.counters.incr(f'multi_platform_{mode}')
+        if mode == 'monolithic':
+            prompt = PromptTemplates.multi_platform_prompt(inputs, self.compact_prompts)
+            return self.generate_content(prompt, max_tokens=MULTI_PLATFORM_MAX_TOKENS, on_section=on_section, prompt_type='multi_platform')
+        
+        results, errors = self.generate_multi_platform_sections(inputs, on_section=on_section)
+        for label, message in errors.items():
+            st.error(f"API Error ({label}): {message}")
+        return results or None
+    
+    def generate_multi_platform_sections(self, inputs, max_workers=MULTI_PLATFORM_WORKERS, on_section=None):
+        """Generate every "All Platforms" section as its own concurrent request.
+        
+        The replies are merged into the same dict shape the monolithic prompt
+        returns. Returns (results, errors) like generate_selected_platforms.
+        """
+        inputs = self.prompt_inputs(inputs)
+        tasks = [
+            (None, section.replace('_', ' ').title(),
+             COMPILED_PROMPTS[f'multi_platform.{section}'].render(inputs, self.compact_prompts),
+             f'multi_platform.{section}')
+            for section in CONTENT_SCHEMAS['multi_platform']['sections']
+        ]
+        return self._run_tasks(tasks, max_workers, on_section, max_tokens=MULTI_PLATFORM_SECTION_TOKENS)
     
-    def generate_all_platforms(self, inputs):
-        prompt = PromptTemplates.multi_platform_prompt(inputs)
-        return self.generate_content(prompt, max_tokens=6000)
+    def generate_selected_platforms(self, inputs, platforms, max_workers=4, on_section=None):
+        """Generate the selected platforms concurrently.
+        
+        Every platform prompt is sent in parallel and the replies are merged
+        into the same dict shape the sequential calls produce. Returns a
+        (results, errors) tuple; errors maps a platform label to its error
+        message so the sections that succeeded are never lost. on_section, if
+        given, is called from the calling thread as each platform finishes.
+        """
+        inputs = self.prompt_inputs(inputs)
+        tasks = []
+        if "Google Ads" in platforms:
+            tasks.append(('google_ads', "Google Ads", PromptTemplates.google_ads_prompt(inputs, self.compact_prompts), 'google_ads'))
+        if "Facebook" in platforms or "Instagram" in platforms:
+            tasks.append((None, "Social Media", PromptTemplates.facebook_instagram_prompt(inputs, self.compact_prompts), 'social'))
+        if "SEO Content" in platforms:
+            tasks.append(('seo', "SEO Content", PromptTemplates.seo_content_prompt(inputs, self.compact_prompts), 'seo'))
+        if "Landing Page" in platforms:
+            tasks.append(('landing_page', "Landing Page", PromptTemplates.landing_page_prompt(inputs, self.compact_prompts), 'landing_page'))
+        
+        return self._run_tasks(tasks, max_workers, on_section)
+    
+    def _run_tasks(self, tasks, max_workers, on_section=None, max_tokens=4000):
+        """Run (key, label, prompt, prompt_type) tasks concurrently and merge the replies"""
+        results = {}
+        errors = {}
+        if not tasks:
+            return results, errors
+        
+        # Worker threads must not touch Streamlit, so errors are collected
+        # here and reported by the caller.
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+            futures = [
+                (key, label, pool.submit(self._generate, prompt, max_tokens, prompt_type=prompt_type))
+                for key, label, prompt, prompt_type in tasks
+            ]
+            
+            if on_section is not None:
+                pending = {future: key for key, label, future in futures}
+                for future in as_completed(pending):
+                    if future.exception() is not None:
+                        continue
+                    data = future.result()
+                    if pending[future] is None:
+                        if isinstance(data, dict):
+                            for section_key, section_value in data.items():
+                                on_section(section_key, section_value)
+                    else:
+                        on_section(pending[future], data)
+        
+        for key, label, future in futures:
+            try:
+                data = future.result()
+            except Exception as e:
+                errors[label] = str(e)
+                continue
+            if key is None:
+                if isinstance(data, dict):
+                    results.update(data)
+            else:
+                results[key] = data
+        
+        return results, errors
+
+# =============================================================================
+# SPECULATIVE PREFETCH
+# =============================================================================
+
+def speculation_key(inputs, settings):
+    """Hash identifying one generation request (inputs plus generator settings) for prefetch lookups"""
+    payload = json.dumps([inputs, settings], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _SpeculativeJob:
+    __slots__ = ('user_key', 'created_at', 'wake', 'cancelled', 'claimed', 'started', 'future')
+    
+    def __init__(self, user_key, created_at):
+        self.user_key = user_key
+        self.created_at = created_at
+        self.wake = threading.Event()
+        self.cancelled = False
+        self.claimed = False
+        self.started = False
+        self.future = None
+
+
+class SpeculativePrefetcher:
+    """Starts generation for a complete form before Generate is clicked.
+    
+    Each prefetch waits ``debounce_seconds`` in a worker of its own executor
+    before calling the API; new inputs for the same user key cancel jobs
+    still in that window. A user key (the app passes a hash of the API key,
+    so the cap spans sessions) may start at most ``budget_per_hour``
+    speculative generations. ``claim`` hands the in-flight or finished future to the
+    Generate click, skipping the rest of the debounce if needed.
+    """
+    
+    def __init__(self, executor, debounce_seconds=2.0, budget_per_hour=10, ttl_seconds=600, counters=None):
+        self.executor = executor
+        self.debounce_seconds = debounce_seconds
+        self.budget_per_hour = budget_per_hour
+        self.ttl_seconds = ttl_seconds
+        self.counters = counters
+        self._jobs = OrderedDict()
+        self._spent = {}
+        self._lock = threading.Lock()
+    
+    def _count(self, name):
+        if self.counters is not None:
+            self.counters.incr(name)
+    
+    def _prune(self, now):
+        while self._jobs:
+            key, job = next(iter(self._jobs.items()))
+            if now - job.created_at <= self.ttl_seconds:
+                break
+            job.cancelled = True
+            job.wake.set()
+            del self._jobs[key]
+    
+    def prefetch(self, user_key, key, task):
+        """Schedule task() for key unless it is already scheduled; returns False if skipped"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if key in self._jobs:
+                return True
+            
+            for job in self._jobs.values():
+                if job.user_key == user_key and not job.started and not job.claimed:
+                    job.cancelled = True
+                    job.wake.set()
+            
+            spent = self._spent.setdefault(user_key, deque())
+            while spent and now - spent[0] > 3600:
+                spent.popleft()
+            if len(spent) >= self.budget_per_hour:
+                self._count('speculative_denied')
+                return False
+            
+            job = _SpeculativeJob(user_key, now)
+            job.future = self.executor.submit(self._run, job, task)
+            self._jobs[key] = job
+            return True
+    
+    def _run(self, job, task):
+        job.wake.wait(self.debounce_seconds)
+        with self._lock:
+            if job.cancelled:
+                self._count('speculative_cancelled')
+                return None
+            if not job.claimed:
+                spent = self._spent.setdefault(job.user_key, deque())
+                if len(spent) >= self.budget_per_hour:
+                    self._count('speculative_denied')
+                    return None
+                spent.append(time.monotonic())
+                self._count('speculative_started')
+            job.started = True
+        return task()
+    
+    def claim(self, key):
+        """Return the future for key (its result is None if cancelled), or None"""
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            if job is None or job.cancelled:
+                return None
+            job.claimed = True
+            if job.started:
+                self._count('speculative_used')
+        job.wake.set()
+        return job.future
+    
+    def cancel(self, user_key):
+        """Cancel every job of user_key that has not started calling the API"""
+        with self._lock:
+            for key, job in list(self._jobs.items()):
+                if job.user_key == user_key and not job.started:
+                    job.cancelled = True
+                    job.wake.set()
+                    del self._jobs[key]
+
+@st.cache_resource
+def get_speculation_executor():
+    """Small pool of its own, so debouncing jobs never hold shared background workers"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix='speculation')
+
+@st.cache_resource
+def get_speculative_prefetcher():
+    """Process-wide prefetcher running on its own executor"""
+    return SpeculativePrefetcher(get_speculation_executor(), counters=get_pipeline_counters())
 
 # =============================================================================
 # EXPORT FUNCTIONS
@@ -1138,7 +5057,7 @@ def export_to_docx(content_data, inputs):
     def add_dict_section(title, data, level=2):
         if data:
             doc.add_heading(title, level=level)
-            if isinstance(data, dict):
+            if isinstance(data, (dict, ContentSection)):
                 for key, value in data.items():
                     if isinstance(value, list):
                         doc.add_heading(key.replace('_', ' ').title(), level=level+1)
@@ -1154,13 +5073,13 @@ def export_to_docx(content_data, inputs):
                         doc.add_paragraph(f"{key.replace('_', ' ').title()}: {value}")
             doc.add_paragraph()
     
-    if isinstance(content_data, dict):
-        for section_name, section_content in content_data.items():
+    if content_data:
+        for section_name, section_content in ContentResult.from_dict(content_data).items():
             section_title = section_name.replace('_', ' ').title()
             
             if isinstance(section_content, list):
                 add_list_section(section_title, section_content)
-            elif isinstance(section_content, dict):
+            elif isinstance(section_content, (dict, ContentSection)):
                 add_dict_section(section_title, section_content)
             else:
                 doc.add_heading(section_title, level=2)
@@ -1261,7 +5180,7 @@ def export_to_pdf(content_data, inputs):
     story.append(Spacer(1, 20))
     
     def add_content_to_story(data, level=0):
-        if isinstance(data, dict):
+        if isinstance(data, (dict, ContentSection, ContentResult)):
             for key, value in data.items():
                 title = key.replace('_', ' ').title()
                 
@@ -1279,7 +5198,7 @@ def export_to_pdf(content_data, inputs):
                         else:
                             text = str(item).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
                             story.append(Paragraph(f"• {text}", bullet_style))
-                elif isinstance(value, dict):
+                elif isinstance(value, (dict, ContentSection)):
                     add_content_to_story(value, level + 1)
                 else:
                     text = str(value).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
@@ -1292,7 +5211,7 @@ def export_to_pdf(content_data, inputs):
                 story.append(Paragraph(f"• {text}", bullet_style))
     
     if content_data:
-        add_content_to_story(content_data)
+        add_content_to_story(ContentResult.from_dict(content_data))
     
     story.append(Spacer(1, 30))
     story.append(Paragraph(
@@ -1484,87 +5403,14 @@ def display_content_results(results, platform_type):
     def is_hashtag_field(key):
         return 'hashtag' in key.lower()
     
-    # Helper function to get first/best item from list
-    def get_best_item(items):
-        if isinstance(items, list) and len(items) > 0:
-            return items[0]
-        return items
-    
-    # Helper function to display hashtags as comma-separated
-    def format_hashtags(hashtags_list):
-        if isinstance(hashtags_list, list):
-            return ", ".join(str(tag) for tag in hashtags_list)
-        return str(hashtags_list)
-    
-    # Extract key content from results
-    headline = ""
-    description = ""
-    cta = ""
-    hashtags = ""
-    keywords = []
-    
-    # Additional content storage
-    extra_content = {}
-    
-    if isinstance(results, dict):
-        for section_name, section_content in results.items():
-            if isinstance(section_content, dict):
-                for key, value in section_content.items():
-                    key_lower = key.lower()
-                    
-                    # Get headline (first one only)
-                    if 'headline' in key_lower and not headline:
-                        if isinstance(value, list) and len(value) > 0:
-                            headline = value[0]
-                        elif isinstance(value, str):
-                            headline = value
-                    
-                    # Get description (first one only)
-                    elif 'description' in key_lower or 'primary_text' in key_lower:
-                        if isinstance(value, list) and len(value) > 0:
-                            if not description:
-                                description = value[0]
-                        elif isinstance(value, str) and not description:
-                            description = value
-                    
-                    # Get CTA
-                    elif 'cta' in key_lower or 'call' in key_lower:
-                        if isinstance(value, list) and len(value) > 0:
-                            if not cta:
-                                cta = value[0]
-                        elif isinstance(value, str) and not cta:
-                            cta = value
-                    
-                    # Get hashtags
-                    elif 'hashtag' in key_lower:
-                        if isinstance(value, list):
-                            hashtags = format_hashtags(value)
-                        elif isinstance(value, str):
-                            hashtags = value
-                    
-                    # Get keywords
-                    elif 'keyword' in key_lower:
-                        if isinstance(value, list):
-                            keywords.extend(value)
-                        elif isinstance(value, dict):
-                            for k, v in value.items():
-                                if isinstance(v, list):
-                                    keywords.extend(v)
-                    
-                    # Store other content
-                    else:
-                        if section_name not in extra_content:
-                            extra_content[section_name] = {}
-                        extra_content[section_name][key] = value
-            
-            elif isinstance(section_content, list):
-                section_lower = section_name.lower()
-                if 'headline' in section_lower and not headline:
-                    headline = section_content[0] if len(section_content) > 0 else ""
-                elif 'hashtag' in section_lower:
-                    hashtags = format_hashtags(section_content)
-                elif 'keyword' in section_lower:
-                    keywords.extend(section_content)
+    # Parsed once; the summary picks the first headline/description/CTA by role
+    results = ContentResult.from_dict(results)
+    summary = results.summary()
+    headline = summary['headline']
+    description = summary['description']
+    cta = summary['cta']
+    hashtags = ", ".join(summary['hashtags'])
+    keywords = summary['keywords']
     
     # Display main content in clean cards
     
@@ -1622,8 +5468,7 @@ def display_content_results(results, platform_type):
     
     # 5. KEYWORDS - Comma separated
     if keywords:
-        unique_keywords = list(dict.fromkeys(keywords))[:20]  # Remove duplicates, limit to 20
-        keywords_str = ", ".join(unique_keywords)
+        keywords_str = ", ".join(keywords[:20])  # Already de-duplicated, limit to 20
         st.markdown(f"""
         <div style="background: white; border-left: 4px solid #667eea; border-radius: 8px; padding: 1.2rem 1.5rem; margin: 1rem 0; box-shadow: 0 2px 10px rgba(0,0,0,0.08);">
             <p style="color: #333; font-size: 0.85rem; font-weight: 600; margin: 0 0 0.5rem 0; text-transform: uppercase; letter-spacing: 0.5px;">
@@ -1639,11 +5484,11 @@ def display_content_results(results, platform_type):
     st.markdown("---")
     
     with st.expander("📋 View All Generated Content", expanded=False):
-        if isinstance(results, dict):
+        if results:
             for section_name, section_content in results.items():
                 st.markdown(f"### {section_name.replace('_', ' ').title()}")
                 
-                if isinstance(section_content, dict):
+                if isinstance(section_content, ContentSection):
                     for key, value in section_content.items():
                         st.markdown(f"**{key.replace('_', ' ').title()}:**")
                         if isinstance(value, list):
@@ -1671,6 +5516,102 @@ def display_content_results(results, platform_type):
                 
                 st.markdown("---")
 
+def generator_settings():
+    """Session settings that decide how a ContentGenerator is built and what it returns"""
+    state = st.session_state
+    return {
+        'api_key': state['api_key'],
+        'model': state.get('model') or DEFAULT_MODEL,
+        'openai_api_key': state.get('openai_api_key') or None,
+        'openai_base_url': state.get('openai_base_url') or None,
+        'openai_model': state.get('openai_model', 'gpt-4o-mini'),
+        'anthropic_api_key': state.get('anthropic_api_key') or None,
+        'anthropic_model': state.get('anthropic_model', 'claude-3-5-haiku-latest'),
+        'use_mock_provider': bool(state.get('use_mock_provider')),
+        'hedge_after': state.get('hedge_after', 8.0) if state.get('hedge_requests') else None,
+        'model_cascade': bool(state.get('model_cascade')),
+        'use_response_cache': state.get('use_response_cache', True),
+        'adaptive_max_tokens': state.get('adaptive_max_tokens', True),
+        'compact_prompts': state.get('compact_prompts', True),
+        'enforce_limits': state.get('enforce_limits', True),
+        'multi_platform_mode': state.get('multi_platform_mode', 'auto'),
+        'use_exemplars': state.get('use_exemplars', True),
+    }
+
+def build_content_generator(use_cache=True):
+    """Return a ContentGenerator wired to the shared clients, cache and router.
+    
+    The generator is kept in the session and only rebuilt when a setting
+    changes, so provider warnings show once instead of on every rerun.
+    """
+    settings = generator_settings()
+    cache_key = (use_cache, tuple(sorted(settings.items())))
+    cached = st.session_state.get('_content_generator')
+    if cached is not None and cached[0] == cache_key:
+        return cached[1]
+    
+    api_key = settings['api_key']
+    model = settings['model']
+    registry = get_client_registry()
+    scheduler = get_rate_limit_scheduler()
+    
+    providers = []
+    
+    def add_provider(label, build):
+        # One misconfigured backend should not take the others down with it.
+        try:
+            providers.append(build())
+        except Exception as e:
+            st.warning(f"⚠️ {label} provider unavailable: {e}")
+    
+    add_provider("Groq", lambda: GroqProvider(registry.get(api_key), model, scheduler, api_key))
+    if settings['openai_api_key']:
+        add_provider("OpenAI-compatible", lambda: OpenAICompatibleProvider(
+            registry.get(
+                settings['openai_api_key'],
+                provider='openai',
+                base_url=settings['openai_base_url']
+            ),
+            settings['openai_model']
+        ))
+    if settings['anthropic_api_key']:
+        add_provider("Anthropic", lambda: AnthropicProvider(
+            registry.get(settings['anthropic_api_key'], provider='anthropic'),
+            settings['anthropic_model']
+        ))
+    if settings['use_mock_provider']:
+        providers.append(MockProvider())
+    if not providers:
+        raise RuntimeError("No LLM provider could be created; check the API keys in Settings")
+    
+    router = LatencyRouter(providers, get_latency_tracker(), hedge_after=settings['hedge_after'])
+    
+    cascade_router = None
+    if settings['model_cascade'] and model != CASCADE_FAST_MODEL:
+        cascade_router = LatencyRouter(
+            [GroqProvider(registry.get(api_key), CASCADE_FAST_MODEL, scheduler, api_key)],
+            get_latency_tracker()
+        )
+    
+    generator = ContentGenerator(
+        api_key,
+        cache=get_response_cache() if settings['use_response_cache'] else None,
+        use_cache=use_cache,
+        scheduler=scheduler,
+        router=router,
+        sizer=get_completion_sizer() if settings['adaptive_max_tokens'] else None,
+        model=model,
+        cascade_router=cascade_router,
+        counters=get_pipeline_counters(),
+        compact_prompts=settings['compact_prompts'],
+        enforce_limits=settings['enforce_limits'],
+        multi_platform_mode=settings['multi_platform_mode'],
+        exemplars=get_exemplar_index() if settings['use_exemplars'] else None,
+        singleflight=get_singleflight()
+    )
+    st.session_state['_content_generator'] = (cache_key, generator)
+    return generator
+
 def render_generate_page():
     """Render the content generation page"""
     st.markdown("""
@@ -1705,21 +5646,93 @@ def render_generate_page():
             use_container_width=True,
             disabled=not is_valid
         )
+        force_fresh = st.checkbox(
+            "🔁 Force fresh generation (skip cache)",
+            value=False,
+            disabled=not (st.session_state.get('use_response_cache', True)
+                          or st.session_state.get('use_similarity_cache', True))
+        )
     
     if not is_valid and generate_btn:
         st.error("⚠️ Please fill in all required fields (*)")
         return
     
+    # Speculative mode: start generating in the background once the form is
+    # complete; the Generate click below then attaches to that work.
+    prefetcher = None
+    if st.session_state.get('speculative_prefetch', False):
+        prefetcher = get_speculative_prefetcher()
+        # Budgeted per API key: new sessions or tabs must not reset the cap.
+        user_key = hashlib.sha256(st.session_state['api_key'].encode('utf-8')).hexdigest()
+        if not is_valid:
+            prefetcher.cancel(user_key)
+        elif not generate_btn:
+            try:
+                speculative_generator = build_content_generator()
+            except RuntimeError:
+                speculative_generator = None  # nothing to prefetch with; Generate reports it
+            if speculative_generator is not None:
+                prefetcher.prefetch(
+                    user_key,
+                    speculation_key(inputs, generator_settings()),
+                    lambda: generate_bulk_row(speculative_generator, inputs)
+                )
+    
     if generate_btn:
+        # Sections are rendered here as they arrive, then replaced by the
+        # full result view once generation has finished.
+        stream_placeholder = st.empty()
+        streamed_sections = {}
+        
+        def show_section(key, value):
+            streamed_sections[key] = value
+            with stream_placeholder.container():
+                display_content_results(streamed_sections, inputs['platform'])
+        
+        on_section = show_section if st.session_state.get('stream_results', True) else None
+        
         with st.spinner("🔄 Creating your high-converting content... This is fast!"):
             try:
-                generator = ContentGenerator(st.session_state['api_key'])
+                generator = build_content_generator(use_cache=not force_fresh)
+                
+                similar = None
+                if st.session_state.get('use_similarity_cache', True) and not force_fresh:
+                    try:
+                        similar = get_similarity_cache().lookup(
+                            inputs, generator.model, st.session_state.get('similarity_threshold', 0.9)
+                        )
+                    except sqlite3.Error as e:
+                        logger.warning("similarity cache lookup failed: %s", e)
+                
+                speculated = None
+                if similar is None and prefetcher is not None and not force_fresh:
+                    future = prefetcher.claim(speculation_key(inputs, generator_settings()))
+                    if future is not None:
+                        try:
+                            speculated = future.result()
+                        except Exception:
+                            speculated = None
                 
                 results = {}
                 platforms = inputs['platform']
                 
-                if "All Platforms" in platforms:
-                    results = generator.generate_all_platforms(inputs)
+                if similar is not None:
+                    results = similar.result
+                    st.info(
+                        f"♻️ Showing the result of a {similar.score:.0%} similar brief from "
+                        f"{datetime.fromtimestamp(similar.created_at).strftime('%Y-%m-%d %H:%M')}. "
+                        "Tick \"Force fresh generation\" to generate a new one."
+                    )
+                elif speculated is not None:
+                    results, errors = speculated
+                    for label, message in errors.items():
+                        st.warning(f"⚠️ {label} failed: {message}")
+                elif "All Platforms" in platforms:
+                    results = generator.generate_all_platforms(inputs, on_section=on_section)
+                elif st.session_state.get('parallel_generation', True):
+                    results, errors = generator.generate_selected_platforms(inputs, platforms, on_section=on_section)
+                    for label, message in errors.items():
+                        st.warning(f"⚠️ {label} failed: {message}")
                 else:
                     if "Google Ads" in platforms:
                         results['google_ads'] = generator.generate_google_ads(inputs)
@@ -1732,6 +5745,23 @@ def render_generate_page():
                     if "Landing Page" in platforms:
                         results['landing_page'] = generator.generate_landing_page(inputs)
                 
+                # Parse and validate once; display, history and exports all use this.
+                results = ContentResult.from_dict(results)
+                if results and similar is None:
+                    if st.session_state.get('dedupe_variants', True):
+                        # Until the backfill finishes only the within-result check runs.
+                        dedupe_index = get_near_duplicate_index()
+                        removed = suppress_near_duplicates(
+                            results, inputs['business_name'], dedupe_index if dedupe_index.ready else None
+                        )
+                        if removed:
+                            get_pipeline_counters().incr('near_duplicates_removed', removed)
+                    if st.session_state.get('use_similarity_cache', True):
+                        try:
+                            get_similarity_cache().store(inputs, generator.model, results)
+                        except sqlite3.Error as e:
+                            logger.warning("similarity cache store failed: %s", e)
+                
                 if results:
                     st.session_state['last_results'] = results
                     st.session_state['last_inputs'] = inputs
@@ -1740,25 +5770,22 @@ def render_generate_page():
                     nlp_keywords = extract_keywords_nlp(text_for_nlp)
                     st.session_state['nlp_keywords'] = nlp_keywords
                     
+                    # Best variant first: the top pick and the order shown both come from here.
+                    CopyRanker(nlp_keywords).rank_result(results)
+                    
                     inputs_for_db = inputs.copy()
                     inputs_for_db['platform'] = ', '.join(inputs['platform']) if isinstance(inputs['platform'], list) else inputs['platform']
                     
-                    flat_outputs = {
-                        'headlines': json.dumps(results.get('google_ads', {}).get('headlines', [])),
-                        'descriptions': json.dumps(results.get('google_ads', {}).get('descriptions', [])),
-                        'hashtags': json.dumps(results.get('instagram', {}).get('hashtags', [])),
-                        'keywords': json.dumps(nlp_keywords),
-                        'cta': json.dumps(results.get('google_ads', {}).get('cta_suggestions', [])),
-                        'seo_title': json.dumps(results.get('seo', {}).get('titles', [])),
-                        'meta_description': json.dumps(results.get('seo', {}).get('meta_descriptions', [])),
-                        'landing_page_content': json.dumps(results.get('landing_page', {}))
-                    }
-                    save_to_history(1, inputs_for_db, flat_outputs)
+                    if similar is None:
+                        flat_outputs = flatten_outputs_for_history(results, nlp_keywords)
+                        get_history_writer().submit(1, inputs_for_db, flat_outputs, result=results)
                     
             except Exception as e:
                 st.error(f"Error generating content: {str(e)}")
                 return
         
+        stream_placeholder.empty()
+        
         if 'last_results' in st.session_state and st.session_state['last_results']:
             st.markdown("---")
             
@@ -1818,7 +5845,7 @@ def render_generate_page():
                 )
             
             with col3:
-                json_str = json.dumps(st.session_state['last_results'], indent=2)
+                json_str = json.dumps(st.session_state['last_results'].to_dict(), indent=2)
                 st.download_button(
                     label="📋 Download JSON",
                     data=json_str,
@@ -1881,27 +5908,58 @@ def render_dashboard():
         """, unsafe_allow_html=True)
     
     st.markdown("---")
+    
+    query = st.text_input(
+        "🔍 Search history",
+        placeholder="Business, product, audience, offer or words from a headline or caption",
+        key='history_search'
+    )
+    
+    if query.strip():
+        # A new query starts again from its first page.
+        if query != st.session_state.get('history_search_last'):
+            st.session_state['history_search_page'] = 1
+            st.session_state['history_search_last'] = query
+        page = st.number_input("Page", min_value=1, step=1, key='history_search_page')
+        found = search_history(query, 1, page=page, per_page=10)
+        
+        st.markdown(
+            f"### 🔎 {found['total']} match{'es' if found['total'] != 1 else ''} "
+            f"(page {found['page']} of {max(1, found['pages'])})"
+        )
+        if not found['ranked']:
+            st.caption("Many matches: showing newest first. Add words to rank by relevance.")
+        for record in found['records']:
+            render_history_record(record)
+        return
+    
     st.markdown("### 📜 Recent Content")
     
-    for i, record in enumerate(history[:10]):
-        with st.expander(f"📌 {record['business_name']} - {record['created_at'][:10] if record['created_at'] else 'N/A'}"):
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.markdown(f"**Business Type:** {record['business_type']}")
-                st.markdown(f"**Platform:** {record['platform']}")
-                st.markdown(f"**Tone:** {record['tone']}")
-            
-            with col2:
-                st.markdown(f"**Target Audience:** {record['target_audience']}")
-                st.markdown(f"**Offer:** {record['offer']}")
-            
-            if record['full_response']:
-                try:
-                    content = json.loads(record['full_response'])
-                    st.json(content)
-                except:
-                    st.text(record['full_response'])
+    for record in history[:10]:
+        render_history_record(record)
+
+def render_history_record(record):
+    """Render one history record as an expander"""
+    with st.expander(f"📌 {record['business_name']} - {record['created_at'][:10] if record['created_at'] else 'N/A'}"):
+        if record.get('headline'):
+            st.markdown(f"**Top Headline:** {record['headline']}")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown(f"**Business Type:** {record['business_type']}")
+            st.markdown(f"**Platform:** {record['platform']}")
+            st.markdown(f"**Tone:** {record['tone']}")
+        
+        with col2:
+            st.markdown(f"**Target Audience:** {record['target_audience']}")
+            st.markdown(f"**Offer:** {record['offer']}")
+        
+        content = record['content']
+        if isinstance(content, dict):
+            st.json(content.get('result', content.get('outputs', content)))
+        elif content:
+            st.text(content)
 
 def render_settings():
     """Render settings page"""
@@ -1926,14 +5984,124 @@ def render_settings():
     
     st.markdown("[🔗 Get FREE Groq API Key](https://console.groq.com)")
     
+    model_options = ["llama-3.3-70b-versatile", "llama-3.1-8b-instant", "mixtral-8x7b-32768"]
+    current_model = st.session_state.get('model') or DEFAULT_MODEL
     model = st.selectbox(
         "AI Model",
-        ["llama-3.3-70b-versatile", "llama-3.1-8b-instant", "mixtral-8x7b-32768"],
+        model_options,
+        index=model_options.index(current_model) if current_model in model_options else 0,
         help="Select the Groq model to use (all FREE!)"
     )
     
     st.session_state['model'] = model
     
+    model_cascade = st.checkbox(
+        f"Cascade: draft with {CASCADE_FAST_MODEL} first",
+        value=st.session_state.get('model_cascade', False),
+        disabled=model == CASCADE_FAST_MODEL,
+        help="Generate with the fast model and re-request only the sections that fail schema or character-limit checks from the selected model"
+    )
+    
+    st.session_state['model_cascade'] = model_cascade
+    
+    counters = get_pipeline_counters().snapshot()
+    if counters.get('cascade_requests'):
+        finished_fast = counters['cascade_requests'] - counters.get('cascade_escalated_requests', 0)
+        st.caption(
+            f"Cascade: {finished_fast}/{counters['cascade_requests']} requests finished on the fast model • "
+            f"{counters.get('cascade_escalated_sections', 0)}/{counters.get('cascade_sections', 0)} sections escalated"
+        )
+    
+    enforce_limits = st.checkbox(
+        "Fix items that break character limits",
+        value=st.session_state.get('enforce_limits', True),
+        help="Check headlines, descriptions, SEO titles and meta descriptions against their limits and rewrite only the offending items in one small follow-up request"
+    )
+    
+    st.session_state['enforce_limits'] = enforce_limits
+    
+    if counters.get('limit_violations'):
+        st.caption(
+            f"Character limits: {counters.get('limit_fixes', 0)}/{counters['limit_violations']} "
+            "violating items rewritten to fit"
+        )
+    
+    st.markdown("---")
+    st.markdown("### 🧠 AI Providers")
+    st.caption("Extra backends are ranked by rolling p95 latency; Groq is always available.")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        openai_api_key = st.text_input(
+            "OpenAI-compatible API Key",
+            type="password",
+            value=st.session_state.get('openai_api_key', '')
+        )
+        openai_base_url = st.text_input(
+            "OpenAI-compatible Base URL",
+            value=st.session_state.get('openai_base_url', ''),
+            placeholder="Leave empty for api.openai.com"
+        )
+        openai_model = st.text_input(
+            "OpenAI-compatible Model",
+            value=st.session_state.get('openai_model', 'gpt-4o-mini')
+        )
+    with col2:
+        anthropic_api_key = st.text_input(
+            "Anthropic API Key",
+            type="password",
+            value=st.session_state.get('anthropic_api_key', '')
+        )
+        anthropic_model = st.text_input(
+            "Anthropic Model",
+            value=st.session_state.get('anthropic_model', 'claude-3-5-haiku-latest')
+        )
+        use_mock_provider = st.checkbox(
+            "Enable local mock backend (offline testing)",
+            value=st.session_state.get('use_mock_provider', False)
+        )
+    
+    st.session_state['openai_api_key'] = openai_api_key
+    st.session_state['openai_base_url'] = openai_base_url
+    st.session_state['openai_model'] = openai_model
+    st.session_state['anthropic_api_key'] = anthropic_api_key
+    st.session_state['anthropic_model'] = anthropic_model
+    st.session_state['use_mock_provider'] = use_mock_provider
+    
+    hedge_requests = st.checkbox(
+        "Hedge slow requests",
+        value=st.session_state.get('hedge_requests', False),
+        help="Fire the next-fastest backend when the first one is slow and keep whichever valid result arrives first"
+    )
+    hedge_after = st.slider(
+        "Hedge after (seconds)",
+        min_value=1.0,
+        max_value=30.0,
+        value=st.session_state.get('hedge_after', 8.0),
+        step=0.5,
+        disabled=not hedge_requests
+    )
+    
+    st.session_state['hedge_requests'] = hedge_requests
+    st.session_state['hedge_after'] = hedge_after
+    
+    routing_stats = get_latency_tracker().stats()
+    if routing_stats['backends']:
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    'Backend': name,
+                    'Samples': data['samples'],
+                    'Failures': data['failures'],
+                    'p95 (s)': round(data['p95_s'], 2)
+                }
+                for name, data in routing_stats['backends'].items()
+            ]),
+            hide_index=True,
+            use_container_width=True
+        )
+        st.caption(f"Hedged requests: {routing_stats['hedges']} • won by hedge: {routing_stats['hedge_wins']}")
+    
     st.markdown("---")
     st.markdown("### 🎨 Content Preferences")
     
@@ -1945,15 +6113,242 @@ def render_settings():
     
     st.session_state['default_tone'] = default_tone
     
+    st.markdown("---")
+    st.markdown("### ⚡ Performance")
+    
+    parallel_generation = st.checkbox(
+        "Generate selected platforms in parallel",
+        value=st.session_state.get('parallel_generation', True),
+        help="Send one request per platform at the same time instead of one after another"
+    )
+    
+    st.session_state['parallel_generation'] = parallel_generation
+    
+    speculative_prefetch = st.checkbox(
+        "Start generating as soon as the form is complete",
+        value=st.session_state.get('speculative_prefetch', False),
+        help="Generation starts in the background a couple of seconds after the required fields stop changing, so Generate shows results sooner. Limited to 10 speculative runs per hour"
+    )
+    
+    st.session_state['speculative_prefetch'] = speculative_prefetch
+    
+    speculative_counts = get_pipeline_counters().snapshot()
+    if speculative_counts.get('speculative_started'):
+        st.caption(
+            f"Speculative runs: {speculative_counts.get('speculative_used', 0)}/"
+            f"{speculative_counts['speculative_started']} used • "
+            f"{speculative_counts.get('speculative_cancelled', 0)} cancelled while inputs changed • "
+            f"{speculative_counts.get('speculative_denied', 0)} over budget"
+        )
+    
+    multi_platform_modes = {
+        'auto': "Automatic (pick the faster one from measured latency)",
+        'monolithic': "One request for everything",
+        'parallel': "One request per section, in parallel"
+    }
+    multi_platform_mode = st.selectbox(
+        "\"All Platforms\" generation",
+        list(multi_platform_modes),
+        index=list(multi_platform_modes).index(st.session_state.get('multi_platform_mode', 'auto')),
+        format_func=multi_platform_modes.get,
+        help="Parallel sections decode side by side, so long outputs finish several times faster at the cost of more requests"
+    )
+    
+    st.session_state['multi_platform_mode'] = multi_platform_mode
+    
+    mode_counts = get_pipeline_counters().snapshot()
+    if mode_counts.get('multi_platform_monolithic') or mode_counts.get('multi_platform_parallel'):
+        st.caption(
+            f"All Platforms runs: {mode_counts.get('multi_platform_parallel', 0)} parallel • "
+            f"{mode_counts.get('multi_platform_monolithic', 0)} single request"
+        )
+    
+    stream_results = st.checkbox(
+        "Show sections as soon as they are generated",
+        value=st.session_state.get('stream_results', True),
+        help="Stream the model response and render each platform the moment it is complete"
+    )
+    
+    st.session_state['stream_results'] = stream_results
+    
+    adaptive_max_tokens = st.checkbox(
+        "Size max_tokens from observed completion lengths",
+        value=st.session_state.get('adaptive_max_tokens', True),
+        help="Request p99 of past completions plus a margin instead of a fixed cap; truncated replies are retried with a larger cap"
+    )
+    
+    st.session_state['adaptive_max_tokens'] = adaptive_max_tokens
+    
+    compact_prompts = st.checkbox(
+        "Send compact prompt schemas",
+        value=st.session_state.get('compact_prompts', True),
+        help="Minify the JSON skeleton in each prompt; counts and limits are kept as inline hints"
+    )
+    
+    st.session_state['compact_prompts'] = compact_prompts
+    
+    dedupe_variants = st.checkbox(
+        "Remove near-duplicate headlines and captions",
+        value=st.session_state.get('dedupe_variants', True),
+        help="Drops variants that are near-identical to another in the same result or to one generated before for the same business"
+    )
+    
+    st.session_state['dedupe_variants'] = dedupe_variants
+    
+    use_exemplars = st.checkbox(
+        "Add strong past copy as examples",
+        value=st.session_state.get('use_exemplars', True),
+        help="Adds up to 3 of the best earlier results for the same business type and tone to the prompt (about 150 tokens at most)"
+    )
+    
+    st.session_state['use_exemplars'] = use_exemplars
+    removed = get_pipeline_counters().snapshot().get('near_duplicates_removed', 0)
+    if removed:
+        st.caption(f"Near-duplicate variants removed so far: {removed}")
+    
+    with st.expander("Prompt template sizes"):
+        estimates = prompt_token_estimates()
+        st.dataframe(
+            [
+                {
+                    'Template': name,
+                    'Full (tokens)': sizes['full'],
+                    'Compact (tokens)': sizes['compact'],
+                    'Saving': f"{1 - sizes['compact'] / sizes['full']:.0%}"
+                }
+                for name, sizes in estimates.items()
+            ],
+            use_container_width=True
+        )
+    
+    use_response_cache = st.checkbox(
+        "Cache responses for identical requests",
+        value=st.session_state.get('use_response_cache', True),
+        help="Re-use a stored result when the same prompt is generated again"
+    )
+    
+    st.session_state['use_response_cache'] = use_response_cache
+    
+    cache_stats = get_response_cache().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Cache Hits", cache_stats['hits'])
+    col2.metric("Cache Misses", cache_stats['misses'])
+    col3.metric("Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+    col4.metric("Cached Responses", cache_stats['entries'])
+    
+    flight_stats = get_singleflight().stats()
+    st.caption(
+        f"Identical in-flight requests coalesced: {flight_stats['deduplicated']} "
+        f"of {flight_stats['executed'] + flight_stats['deduplicated']} "
+        f"({flight_stats['dedupe_rate']:.0%})"
+    )
+    
+    if st.button("🧹 Clear Response Cache", type="secondary"):
+        get_response_cache().clear()
+        st.success("✅ Response cache cleared!")
+        st.rerun()
+    
+    use_similarity_cache = st.checkbox(
+        "Reuse results for near-identical briefs",
+        value=st.session_state.get('use_similarity_cache', True),
+        help="When the business name, platforms, tone and model match and the descriptions are almost the same, show the stored result instead of generating again"
+    )
+    
+    st.session_state['use_similarity_cache'] = use_similarity_cache
+    
+    similarity_threshold = st.slider(
+        "Similarity needed to reuse a result",
+        min_value=0.5,
+        max_value=1.0,
+        value=float(st.session_state.get('similarity_threshold', 0.9)),
+        step=0.01,
+        disabled=not use_similarity_cache,
+        help="TF-IDF cosine similarity of business type, product/service, audience and offer"
+    )
+    
+    st.session_state['similarity_threshold'] = similarity_threshold
+    
+    similarity_stats = get_similarity_cache().stats()
+    st.caption(
+        f"Similar-brief reuse: {similarity_stats['hits']} hits • {similarity_stats['misses']} misses • "
+        f"{similarity_stats['entries']} stored briefs"
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        requests_per_minute = st.number_input(
+            "Requests per minute limit",
+            min_value=1,
+            value=get_rate_limit_scheduler().requests_per_minute,
+            help="Your Groq plan's requests/minute limit; traffic is kept just under it"
+        )
+    with col2:
+        tokens_per_minute = st.number_input(
+            "Tokens per minute limit",
+            min_value=1000,
+            step=1000,
+            value=get_rate_limit_scheduler().tokens_per_minute,
+            help="Your Groq plan's tokens/minute limit; traffic is kept just under it"
+        )
+    
+    get_rate_limit_scheduler().configure(int(requests_per_minute), int(tokens_per_minute))
+    
+    client_stats = get_client_registry().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Pooled Clients", client_stats['clients'])
+    col2.metric("Connection Handshakes", f"{client_stats['handshakes']}/{client_stats['requests']}")
+    col3.metric("Avg Handshake", f"{client_stats['avg_handshake_ms']:.0f} ms")
+    col4.metric("Saved per Request", f"{client_stats['saved_per_request_ms']:.0f} ms")
+    
+    sizing_stats = get_completion_sizer().stats()
+    if sizing_stats:
+        st.dataframe(
+            pd.DataFrame([
+                {'Prompt Type': prompt_type, 'Samples': data['samples'], 'p50 Tokens': data['p50'], 'p99 Tokens': data['p99']}
+                for prompt_type, data in sizing_stats.items()
+            ]),
+            hide_index=True,
+            use_container_width=True
+        )
+    
+    scheduler_stats = get_rate_limit_scheduler().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Queued Requests", scheduler_stats['waiting'])
+    col2.metric("Peak Queue", scheduler_stats['peak_waiting'])
+    col3.metric("Rate-Limit Retries", scheduler_stats['retries'])
+    col4.metric("Rejected (Queue Full)", scheduler_stats['rejected'])
+    
+    writer_stats = get_history_writer().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("History Queue", f"{writer_stats['depth']}/{writer_stats['capacity']}")
+    col2.metric("Peak History Queue", writer_stats['peak_depth'])
+    col3.metric("Avg Rows per Commit", f"{writer_stats['avg_batch']:.1f}")
+    col4.metric("Backpressure Waits", writer_stats['blocked'])
+    if writer_stats['failed']:
+        st.warning(f"⚠️ {writer_stats['failed']} history rows failed to save. Last error: {writer_stats['last_error']}")
+    
     st.markdown("---")
     st.markdown("### 📊 Data Management")
     
+    storage = history_storage_stats()
+    st.caption(
+        f"History storage: {storage['compressed_rows']} compressed rows ({storage['compressed_bytes'] / 1024:.0f} KB), "
+        f"{storage['legacy_rows']} legacy rows awaiting compaction ({storage['legacy_bytes'] / 1024:.0f} KB)"
+    )
+    
+    if st.button("🗜️ Reclaim Disk Space", type="secondary", help="VACUUM the database after compaction"):
+        with get_database_pool().connection() as conn:
+            conn.execute("VACUUM")
+        st.success("✅ Database compacted!")
+    
     if st.button("🗑️ Clear All History", type="secondary"):
-        conn = sqlite3.connect('sales_content.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM content_history")
-        conn.commit()
-        conn.close()
+        with get_database_pool().transaction() as cursor:
+            cursor.execute("DELETE FROM content_history")
+            # The near-duplicate and exemplar indexes are derived from history; drop them with it
+            cursor.execute("DELETE FROM headline_minhash")
+            cursor.execute("DELETE FROM headline_minhash_state")
+            cursor.execute("DELETE FROM exemplar_index")
+            cursor.execute("DELETE FROM exemplar_index_state")
         st.success("✅ History cleared successfully!")
         st.rerun()
 
@@ -2096,6 +6491,329 @@ def render_home():
     </div>
     """, unsafe_allow_html=True)
 
+# =============================================================================
+# HEADLESS BULK GENERATION (CLI)
+# =============================================================================
+
+BULK_INPUT_FIELDS = ['business_name', 'business_type', 'product_service', 'target_audience', 'offer', 'tone', 'platform']
+
+def read_bulk_rows(path):
+    """Yield (row_number, inputs) from a CSV or JSONL file of businesses"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson')):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = csv.DictReader(f)
+        
+        for row_number, record in enumerate(records, 1):
+            inputs = {field: (record.get(field) or '') for field in BULK_INPUT_FIELDS}
+            platform = inputs['platform']
+            if isinstance(platform, str):
+                platform = [p.strip() for p in platform.split(',') if p.strip()]
+            inputs['platform'] = platform or ["All Platforms"]
+            inputs['tone'] = inputs['tone'] or 'Professional'
+            yield row_number, inputs
+
+def load_checkpoint(path):
+    """Return the row numbers listed in a checkpoint file written by older bulk runs"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {int(line) for line in f if line.strip().isdigit()}
+
+def load_bulk_progress(output_path):
+    """Return the row numbers output_path already holds a successful result for.
+    
+    A torn last line from a crash mid-write is ignored, so that row runs again.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    completed = set()
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and record.get('status', 'ok') == 'ok' and record.get('results'):
+                completed.add(record.get('row'))
+    return completed
+
+def save_bulk_row(run_key, row_number, user_id, inputs, outputs, result, pool=None):
+    """Save one bulk row to history unless this run already saved it; returns the history id"""
+    pool = pool or get_database_pool()
+    with pool.transaction() as cursor:
+        row = cursor.execute(
+            'SELECT history_id FROM bulk_history WHERE run_key = ? AND row_number = ?', (run_key, row_number)
+        ).fetchone()
+        if row:
+            return row[0]
+        history_id = insert_history(cursor, user_id, inputs, outputs, result, get_result_codec(pool.db_path))
+        cursor.execute(
+            'INSERT INTO bulk_history (run_key, row_number, history_id) VALUES (?, ?, ?)',
+            (run_key, row_number, history_id)
+        )
+    return history_id
+
+def generate_bulk_row(generator, inputs):
+    """Generate one business; returns (results, errors) without touching Streamlit"""
+    platforms = inputs['platform']
+    if "All Platforms" in platforms:
+        inputs = generator.prompt_inputs(inputs)
+        if generator.choose_multi_platform_mode(inputs) == 'parallel':
+            return generator.generate_multi_platform_sections(inputs)
+        try:
+            prompt = PromptTemplates.multi_platform_prompt(inputs, generator.compact_prompts)
+            return generator._generate(prompt, max_tokens=MULTI_PLATFORM_MAX_TOKENS, prompt_type='multi_platform'), {}
+        except Exception as e:
+            return {}, {"All Platforms": str(e)}
+    return generator.generate_selected_platforms(inputs, platforms)
+
+def run_bulk_generation(input_path, output_path, api_key, workers=4, checkpoint_path=None,
+                        user_id=1, save_history=True, requests_per_minute=30, tokens_per_minute=12000):
+    """Generate content for every business in input_path with bounded concurrency.
+    
+    Results are saved to content_history and then appended to output_path
+    as JSONL as they complete. The output line is the checkpoint: a re-run
+    with the same arguments skips rows it already holds a result for, and
+    history rows are keyed by output file and row number, so a row that
+    crashed between the two is not saved twice. A row that raises is
+    written as a failed line and retried on the next run; the run goes on.
+    Row numbers in checkpoint_path (written by older versions) are skipped
+    too.
+    """
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+    completed = load_checkpoint(checkpoint_path) | load_bulk_progress(output_path)
+    run_key = os.path.abspath(output_path)
+    
+    init_database()
+    dedupe_index = NearDuplicateIndex()
+    scheduler = RateLimitScheduler(requests_per_minute, tokens_per_minute, max_waiting=max(32, workers * 4))
+    generator = ContentGenerator(
+        api_key,
+        cache=ResponseCache(),
+        client=ClientRegistry().get(api_key),
+        scheduler=scheduler,
+        sizer=CompletionSizer(),
+        exemplars=ExemplarIndex(),
+        singleflight=SingleFlight()
+    )
+    
+    done = failed = skipped = 0
+    started = time.time()
+    
+    with open(output_path, 'a', encoding='utf-8') as output, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        
+        def process(future, row_number, inputs):
+            results, errors = future.result()
+            results = ContentResult.from_dict(results)
+            if results:
+                suppress_near_duplicates(results, inputs['business_name'], dedupe_index)
+                try:
+                    keywords = extract_keywords_nlp(f"{inputs['product_service']} {inputs['target_audience']} {inputs['offer']}")
+                except Exception:
+                    keywords = []
+                CopyRanker(keywords).rank_result(results)
+                if save_history:
+                    inputs_for_db = dict(inputs, platform=', '.join(inputs['platform']))
+                    save_bulk_row(run_key, row_number, user_id, inputs_for_db,
+                                  flatten_outputs_for_history(results, keywords), results)
+            return results, errors
+        
+        def handle(future, row_number, inputs):
+            nonlocal done, failed
+            try:
+                results, errors = process(future, row_number, inputs)
+            except Exception as e:
+                print(f"[bulk] row {row_number}: {e}", file=sys.stderr)
+                results, errors = ContentResult.from_dict({}), {'row': str(e)}
+            
+            # One line per row, written and flushed in one step: it is the checkpoint.
+            output.write(json.dumps({
+                'row': row_number,
+                'status': 'ok' if results else 'failed',
+                'inputs': inputs,
+                'results': results.to_dict(),
+                'errors': errors,
+                'generated_at': datetime.now().isoformat(timespec='seconds')
+            }, ensure_ascii=False, separators=(',', ':')) + '\n')
+            output.flush()
+            
+            if not results:
+                failed += 1
+                return
+            done += 1
+            if done % 10 == 0:
+                rate = done / max(time.time() - started, 1e-9)
+                print(f"[bulk] {done} done, {failed} failed, {skipped} skipped ({rate:.2f} rows/s)", file=sys.stderr)
+        
+        # Keep at most two rows per worker in flight so huge files stream through.
+        in_flight = {}
+        for row_number, inputs in read_bulk_rows(input_path):
+            if row_number in completed:
+                skipped += 1
+                continue
+            if not all(inputs.get(field) for field in ['business_name', 'business_type', 'product_service', 'target_audience']):
+                print(f"[bulk] row {row_number}: missing required fields, skipped", file=sys.stderr)
+                skipped += 1
+                continue
+            
+            while len(in_flight) >= workers * 2:
+                finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    handle(future, *in_flight.pop(future))
+            
+            in_flight[pool.submit(generate_bulk_row, generator, inputs)] = (row_number, inputs)
+        
+        for future in as_completed(list(in_flight)):
+            handle(future, *in_flight.pop(future))
+    
+    print(f"[bulk] finished: {done} generated, {failed} failed, {skipped} skipped in {time.time() - started:.1f}s", file=sys.stderr)
+    return {'generated': done, 'failed': failed, 'skipped': skipped}
+
+class _ConnectPerCall:
+    """The unpooled access pattern: a fresh default connection for every call"""
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+    
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            yield cursor
+            conn.commit()
+
+def run_db_benchmark(sessions=8, operations=200, directory=None):
+    """Compare history throughput of per-call connections and the pool under parallel sessions.
+    
+    Each strategy gets a fresh database in a temporary directory. Every
+    session runs `operations` save_to_history calls (write), then as many
+    get_user_history calls (read), then half the sessions write while the
+    other half read (mixed). Returns {strategy: {phase: stats}}.
+    """
+    sample = {
+        'google_ads': {
+            'headlines': [f"Fresh Local Coffee Delivered Daily {i}" for i in range(5)],
+            'descriptions': ["Small-batch roasts from our neighbourhood roastery, at your door every morning."]
+        },
+        'instagram': {'captions': ["Morning ritual, sorted."], 'hashtags': ['#coffee', '#local']}
+    }
+    outputs = flatten_outputs_for_history(sample, ['coffee', 'delivery'])
+    
+    def inputs_for(session):
+        return {
+            'business_name': f"Bench Cafe {session}",
+            'business_type': 'Coffee Shop',
+            'product_service': 'Coffee delivery',
+            'target_audience': 'Commuters',
+            'tone': 'Friendly',
+            'platform': 'Google Ads'
+        }
+    
+    def write(pool, session):
+        save_to_history(session, inputs_for(session), outputs, pool=pool)
+    
+    def read(pool, session):
+        get_user_history(session, limit=20, pool=pool)
+    
+    def run_phase(pool, actions):
+        errors = 0
+        
+        def session_loop(session, action):
+            nonlocal errors
+            for _ in range(operations):
+                try:
+                    action(pool, session)
+                except sqlite3.OperationalError:
+                    errors += 1
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool_threads:
+            for future in [pool_threads.submit(session_loop, session, action) for session, action in enumerate(actions)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        total = sessions * operations
+        return {'ops': total, 'seconds': elapsed, 'ops_per_second': total / elapsed, 'errors': errors}
+    
+    strategies = {
+        'per_call': _ConnectPerCall,
+        'pooled_wal': lambda path: ConnectionPool(path, max_size=sessions)
+    }
+    report = {}
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        for name, make in strategies.items():
+            pool = make(os.path.join(tmp, f"{name}.db"))
+            init_database(pool)
+            report[name] = {
+                'write': run_phase(pool, [write] * sessions),
+                'read': run_phase(pool, [read] * sessions),
+                'mixed': run_phase(pool, [write if session % 2 == 0 else read for session in range(sessions)])
+            }
+            if isinstance(pool, ConnectionPool):
+                pool.close()
+    return report
+
+def run_cli(argv):
+    """Entry point for headless commands: python "ai_content_gen (1).py" bulk ..."""
+    parser = argparse.ArgumentParser(prog='ai_content_gen', description='AI Sales Copy Agent (headless)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    bulk = subparsers.add_parser('bulk', help='Generate content for a CSV/JSONL file of businesses')
+    bulk.add_argument('input', help='CSV or JSONL file with business_name, business_type, product_service, target_audience, offer, tone, platform')
+    bulk.add_argument('output', help='JSONL file results are appended to')
+    bulk.add_argument('--workers', type=int, default=4, help='concurrent businesses (default: 4)')
+    bulk.add_argument('--checkpoint', help='checkpoint file of runs from older versions to skip rows from (default: OUTPUT.checkpoint)')
+    bulk.add_argument('--api-key', default=os.getenv('GROQ_API_KEY', ''), help='Groq API key (default: $GROQ_API_KEY)')
+    bulk.add_argument('--user-id', type=int, default=1, help='content_history user id (default: 1)')
+    bulk.add_argument('--no-history', action='store_true', help='do not save results to content_history')
+    bulk.add_argument('--rpm', type=int, default=30, help='requests/minute limit (default: 30)')
+    bulk.add_argument('--tpm', type=int, default=12000, help='tokens/minute limit (default: 12000)')
+    
+    bench = subparsers.add_parser('bench-db', help='Benchmark history reads/writes under parallel sessions')
+    bench.add_argument('--sessions', type=int, default=8, help='concurrent sessions (default: 8)')
+    bench.add_argument('--ops', type=int, default=200, help='operations per session and phase (default: 200)')
+    bench.add_argument('--dir', help='directory for the temporary databases (default: system temp)')
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'bulk':
+        if not args.api_key:
+            parser.error('a Groq API key is required (--api-key or GROQ_API_KEY)')
+        summary = run_bulk_generation(
+            args.input,
+            args.output,
+            args.api_key,
+            workers=max(1, args.workers),
+            checkpoint_path=args.checkpoint,
+            user_id=args.user_id,
+            save_history=not args.no_history,
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm
+        )
+        return 0 if summary['failed'] == 0 else 1
+    
+    if args.command == 'bench-db':
+        report = run_db_benchmark(max(1, args.sessions), max(1, args.ops), args.dir)
+        print(f"{'strategy':<12} {'phase':<6} {'ops/s':>10} {'seconds':>9} {'errors':>7}")
+        for name, phases in report.items():
+            for phase, stats in phases.items():
+                print(f"{name:<12} {phase:<6} {stats['ops_per_second']:>10.0f} {stats['seconds']:>9.2f} {stats['errors']:>7}")
+        return 0
+    
+    return 2
+
+CLI_COMMANDS = {'bulk', 'bench-db'}
+
 # =============================================================================
 # MAIN APPLICATION
 # =============================================================================
@@ -2112,8 +6830,8 @@ def main():
     # Inject premium CSS
     st.markdown(PREMIUM_CSS, unsafe_allow_html=True)
     
-    # Initialize database
-    init_database()
+    # Initialize database (migrations run once per process)
+    ensure_database()
     
     # Initialize session state
     if 'api_key' not in st.session_state:
@@ -2140,4 +6858,6 @@ def main():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(run_cli(sys.argv[1:]))
     main()